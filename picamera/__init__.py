@@ -30,6 +30,10 @@ from picamera.display import PiDisplay
 from picamera.frames import PiVideoFrame, PiVideoFrameType
 from picamera.encoders import (
     PiEncoder,
+    PiEncoderWriter,
+    PiEncoderTee,
+    PiEncoderFrameWriter,
+    PiEncoderPool,
     PiVideoEncoder,
     PiImageEncoder,
     PiRawMixin,
@@ -49,5 +53,24 @@ from picamera.renderers import (
     PiPreviewRenderer,
     PiNullSink,
     )
-from picamera.streams import PiCameraCircularIO, CircularIO, BufferIO
+from picamera.streams import (
+    PiCameraCircularIO,
+    PiCameraTieredCircularIO,
+    PiCameraFramesUpdate,
+    PiCameraSegmenter,
+    PiCameraSegment,
+    CircularIO,
+    CircularIOCursor,
+    BufferIO,
+    )
+from picamera.containers import (
+    PiMPEGTSMuxer,
+    PiMP4Muxer,
+    PiCameraHLSOutput,
+    PiCameraMP4Output,
+    PiNALScanner,
+    PiCameraIndexedOutput,
+    PiH264Index,
+    PiH264IndexEntry,
+    )
 from picamera.color import Color, Red, Green, Blue, Hue, Lightness, Saturation
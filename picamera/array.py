@@ -17,6 +17,9 @@ except NameError:
 import io
 import ctypes as ct
 import warnings
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 from numpy.lib.stride_tricks import as_strided
@@ -50,35 +53,178 @@ def raw_resolution(resolution, splitter=False):
     return fwidth, fheight
 
 
+class PiYUVPlanes(object):
+    """
+    Provides the planes of a YUV420 (I420) frame as `numpy`_ arrays which
+    are views of the original buffer, cropped to the frame's resolution.
+
+    .. attribute:: Y
+
+        The luma plane, a (height, width) array.
+
+    .. attribute:: U
+
+        The blue-difference plane, at half the resolution of :attr:`Y`.
+
+    .. attribute:: V
+
+        The red-difference plane, at half the resolution of :attr:`Y`.
+
+    .. attribute:: UV
+
+        A (height/2, width/2, 2) view of :attr:`U` and :attr:`V` together,
+        arranged like the interleaved chroma plane of NV12.
+
+    No data is copied until :meth:`packed` is called to produce the
+    full-resolution (height, width, 3) array returned by
+    :func:`bytes_to_yuv`. As the planes are views, they are only valid
+    while the buffer they were created from is.
+    """
+
+    def __init__(self, data, resolution):
+        width, height = resolution
+        fwidth, fheight = raw_resolution(resolution)
+        y_len = fwidth * fheight
+        uv_len = (fwidth // 2) * (fheight // 2)
+        if len(data) != (y_len + 2 * uv_len):
+            raise PiCameraValueError(
+                'Incorrect buffer length for resolution %dx%d' % (width, height))
+        self.resolution = mo.PiResolution(width, height)
+        cwidth, cheight = (width + 1) // 2, (height + 1) // 2
+        a = np.frombuffer(data, dtype=np.uint8)
+        self.Y = a[:y_len].reshape((fheight, fwidth))[:height, :width]
+        Uq = a[y_len:y_len + uv_len].reshape((fheight // 2, fwidth // 2))
+        self.U = Uq[:cheight, :cwidth]
+        self.V = a[y_len + uv_len:].reshape(
+            (fheight // 2, fwidth // 2))[:cheight, :cwidth]
+        # The V plane follows the U plane, so a stride of uv_len along the
+        # last axis pairs each U sample with its V sample
+        self.UV = as_strided(
+            Uq, shape=(cheight, cwidth, 2),
+            strides=Uq.strides + (uv_len,), writeable=False)
+
+    def packed(self, out=None):
+        """
+        Returns a (height, width, 3) array of the frame, upsampling the
+        chroma planes to full resolution. If *out* is specified, it must be
+        a C-contiguous array of that shape, and is filled and returned.
+        """
+        width, height = self.resolution
+        if out is None:
+            out = np.empty((height, width, 3), dtype=np.uint8)
+        elif out.shape != (height, width, 3) or not out.flags.c_contiguous:
+            raise PiCameraValueError(
+                'out must be a contiguous %dx%dx3 array' % (width, height))
+        out[..., 0] = self.Y
+        # Copy each chroma plane straight into the four pixels of each 2x2
+        # block; at an odd edge, the last row or column of blocks is partial
+        for channel, plane in ((1, self.U), (2, self.V)):
+            for row in (0, 1):
+                for col in (0, 1):
+                    dest = out[row::2, col::2, channel]
+                    dest[...] = plane[:dest.shape[0], :dest.shape[1]]
+        return out
+
+
+# The (Kr, Kb) luma coefficients of the supported YUV standards
+_YUV_STANDARDS = {
+    'bt601': (0.299, 0.114),
+    'bt709': (0.2126, 0.0722),
+    }
+
+# The fractional bits of the fixed-point YUV to RGB conversion; with 5 bits
+# every intermediate sum fits in an int16
+_YUV_FRACTION = 5
+
+_yuv_luts = {}
+
+
+def _yuv_to_rgb_luts(standard, full_range):
+    # Returns lookup tables of the fixed-point contribution of each Y, U and
+    # V value to the R, G and B channels; the Y table includes the rounding
+    # term of the final shift
+    key = (standard, full_range)
+    try:
+        return _yuv_luts[key]
+    except KeyError:
+        pass
+    try:
+        kr, kb = _YUV_STANDARDS[standard]
+    except KeyError:
+        raise PiCameraValueError('Invalid YUV standard %s' % standard)
+    kg = 1 - kr - kb
+    if full_range:
+        y_scale, c_scale, y_offset = 1.0, 1.0, 0
+    else:
+        y_scale, c_scale, y_offset = 255 / 219, 255 / 224, 16
+    one = 1 << _YUV_FRACTION
+    values = np.arange(256, dtype=np.float64)
+    c = (values - 128) * c_scale * one
+    luts = tuple(np.round(lut).astype(np.int16) for lut in (
+        (values - y_offset) * y_scale * one + one // 2,
+        c * 2 * (1 - kr),               # V to R
+        -c * 2 * kb * (1 - kb) / kg,    # U to G
+        -c * 2 * kr * (1 - kr) / kg,    # V to G
+        c * 2 * (1 - kb),               # U to B
+        ))
+    _yuv_luts[key] = luts
+    return luts
+
+
+def yuv_to_rgb(planes, out=None, standard='bt601', full_range=False):
+    """
+    Converts the :class:`PiYUVPlanes` *planes* to a (height, width, 3) RGB
+    array, which is written to *out* if specified.
+
+    *standard* selects the ``'bt601'`` or ``'bt709'`` conversion matrix and
+    *full_range* whether the YUV values span 0-255 rather than the limited
+    ("studio") range used by the camera. The conversion uses fixed-point
+    lookup tables and works at the chroma planes' resolution, so the chroma
+    is never upsampled.
+    """
+    y_lut, rv_lut, gu_lut, gv_lut, bu_lut = _yuv_to_rgb_luts(
+        standard, full_range)
+    width, height = planes.resolution
+    if out is None:
+        out = np.empty((height, width, 3), dtype=np.uint8)
+    elif out.shape != (height, width, 3):
+        raise PiCameraValueError(
+            'out must be a %dx%dx3 array' % (width, height))
+    Y = y_lut[planes.Y]
+    chroma = (
+        rv_lut[planes.V],
+        gu_lut[planes.U] + gv_lut[planes.V],
+        bu_lut[planes.U],
+        )
+    temp = np.empty(planes.U.shape, dtype=np.int16)
+    # Each chroma sample applies to a 2x2 block of pixels, so each channel is
+    # computed in four strided passes, one per position in the block
+    for channel, contribution in enumerate(chroma):
+        for row in (0, 1):
+            for col in (0, 1):
+                luma = Y[row::2, col::2]
+                rows, cols = luma.shape
+                t = temp[:rows, :cols]
+                np.add(luma, contribution[:rows, :cols], out=t)
+                np.right_shift(t, _YUV_FRACTION, out=t)
+                np.clip(t, 0, 255, out=t)
+                out[row::2, col::2, channel] = t
+    return out
+
+
+def bytes_to_yuv420(data, resolution):
+    """
+    Converts a bytes object containing YUV420 data to a
+    :class:`PiYUVPlanes` object which provides views of its planes.
+    """
+    return PiYUVPlanes(data, resolution)
+
+
 def bytes_to_yuv(data, resolution):
     """
     Converts a bytes object containing YUV data to a `numpy`_ array.
     """
-    width, height = resolution
-    fwidth, fheight = raw_resolution(resolution)
-    y_len = fwidth * fheight
-    uv_len = (fwidth // 2) * (fheight // 2)
-    if len(data) != (y_len + 2 * uv_len):
-        raise PiCameraValueError(
-            'Incorrect buffer length for resolution %dx%d' % (width, height))
-    # Separate out the Y, U, and V values from the array
-    a = np.frombuffer(data, dtype=np.uint8)
-    Y = a[:y_len].reshape((fheight, fwidth))
-    Uq = a[y_len:-uv_len].reshape((fheight // 2, fwidth // 2))
-    Vq = a[-uv_len:].reshape((fheight // 2, fwidth // 2))
-
-    U = np.empty_like(Y)
-    V = np.empty_like(Y)
-    U[0::2, 0::2] = Uq
-    U[0::2, 1::2] = Uq
-    U[1::2, 0::2] = Uq
-    U[1::2, 1::2] = Uq
-    V[0::2, 0::2] = Vq
-    V[0::2, 1::2] = Vq
-    V[1::2, 0::2] = Vq
-    V[1::2, 1::2] = Vq
-    # Stack the channels together and crop to the actual resolution
-    return np.dstack((Y, U, V))[:height, :width]
+    return bytes_to_yuv420(data, resolution).packed()
 
 
 def bytes_to_rgb(data, resolution):
@@ -146,28 +292,418 @@ class PiYUVArray(PiArrayOutput):
         super(PiYUVArray, self).__init__(camera, size)
         self._rgb = None
 
+    @property
+    def array(self):
+        """
+        The captured frame as a (height, width, 3) array, which is only
+        constructed from :attr:`planes` when first read.
+        """
+        if self._array is None and self.planes is not None:
+            self._array = self.planes.packed()
+        return self._array
+
+    @array.setter
+    def array(self, value):
+        self._array = value
+        self.planes = None
+
     def flush(self):
         super(PiYUVArray, self).flush()
-        self.array = bytes_to_yuv(self.getvalue(), self.size or self.camera.resolution)
+        self.array = None
+        self.planes = bytes_to_yuv420(
+            self.getvalue(), self.size or self.camera.resolution)
+        self._rgb = None
+
+    @property
+    def rgb_array(self):
+        if self._rgb is None and self.planes is not None:
+            # YUV conversion from ITU-R BT.601 version (SDTV)
+            self._rgb = yuv_to_rgb(self.planes)
+        return self._rgb
+
+
+# Marks a frame being discarded by PiPooledArrayOutput
+_DROPPED = object()
+
+
+class PiPooledArrayOutput(io.IOBase):
+    """
+    Base class for array outputs which write each frame into one of a ring
+    of *frames* buffers, allocated up front from the :func:`raw_resolution`
+    of *size* (or the camera's resolution), instead of growing a
+    :class:`~io.BytesIO` and copying its value.
+
+    When a frame has been written, :meth:`flush` (called by the camera after
+    each capture) provides it as a view of its buffer. The buffer stays in
+    use, so the view remains valid, until it is passed to :meth:`release`.
+    Calling :meth:`truncate`, as is done between frames with
+    :class:`PiArrayOutput` (after ``seek(0)``), releases all buffers. If
+    every buffer is in use when a new frame arrives, the frame is discarded
+    (as :meth:`write` is called from the camera's callback, which must not
+    wait), :attr:`array` is ``None`` once it has been flushed, and it is
+    counted by :attr:`dropped_frames`.
+    """
+
+    def __init__(self, camera, size=None, frames=2):
+        super(PiPooledArrayOutput, self).__init__()
+        if frames < 1:
+            raise PiCameraValueError('frames must be at least 1')
+        self.camera = camera
+        self.size = size
+        self.array = None
+        self._lock = threading.Lock()
+        length = self._frame_length(size or camera.resolution)
+        self._buffers = [np.empty(length, dtype=np.uint8) for i in range(frames)]
+        self._views = [memoryview(buf) for buf in self._buffers]
+        self._free = deque(range(frames))
+        self._used = deque()
+        # The slot of the frame being written (_DROPPED if it is being
+        # discarded), the position within it, and its length so far
+        self._current = None
+        self._pos = 0
+        self._length = 0
+        self._dropped_frames = 0
+
+    def _frame_length(self, resolution):
+        """
+        Returns the size of the buffers required for *resolution*.
+        """
+        raise NotImplementedError
+
+    def _frame_ready(self, data, resolution):
+        """
+        Sets the attributes describing the frame in the memoryview *data*.
+        """
+        raise NotImplementedError
+
+    @property
+    def dropped_frames(self):
+        """
+        Returns the number of frames discarded because every buffer was in
+        use.
+        """
+        return self._dropped_frames
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        """
+        Returns the position within the frame being written.
+        """
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        """
+        Changes the position within the frame being written. Between frames
+        the only position is 0.
+        """
+        with self._lock:
+            if whence == io.SEEK_CUR:
+                offset += self._pos
+            elif whence == io.SEEK_END:
+                offset += self._length
+            elif whence != io.SEEK_SET:
+                raise PiCameraValueError('Invalid whence %s' % whence)
+            if offset < 0:
+                raise PiCameraValueError('Negative seek position %d' % offset)
+            self._pos = offset if self._current is not None else 0
+            return self._pos
+
+    def write(self, b):
+        length = len(b)
+        with self._lock:
+            if self._current is None:
+                try:
+                    self._current = self._free.popleft()
+                except IndexError:
+                    self._current = _DROPPED
+                self._pos = self._length = 0
+            if self._current is _DROPPED:
+                return length
+            view = self._views[self._current]
+            if self._pos + length > len(view):
+                raise PiCameraValueError(
+                    'Frame is larger than the output\'s buffers')
+            view[self._pos:self._pos + length] = b
+            self._pos += length
+            self._length = max(self._length, self._pos)
+        return length
+
+    def flush(self):
+        super(PiPooledArrayOutput, self).flush()
+        with self._lock:
+            slot, length = self._current, self._length
+            self._current = None
+            self._pos = self._length = 0
+            if slot is _DROPPED:
+                self._dropped_frames += 1
+        if slot is _DROPPED:
+            self.array = None
+        elif slot is not None:
+            try:
+                self._frame_ready(
+                    self._views[slot][:length],
+                    self.size or self.camera.resolution)
+            except:
+                with self._lock:
+                    self._free.append(slot)
+                raise
+            with self._lock:
+                self._used.append(slot)
+
+    def release(self, array=None):
+        """
+        Returns the buffer of *array* (an array or planes provided by this
+        output) to the pool, or that of the oldest frame still in use if
+        *array* is ``None``.
+        """
+        with self._lock:
+            if array is None:
+                try:
+                    slot = self._used.popleft()
+                except IndexError:
+                    raise PiCameraValueError('No frames are in use')
+            else:
+                slot = self._slot(array)
+                self._used.remove(slot)
+            self._free.append(slot)
+
+    def _slot(self, array):
+        array = getattr(array, 'Y', array)
+        address = array.__array_interface__['data'][0]
+        for slot in self._used:
+            buf = self._buffers[slot]
+            start = buf.__array_interface__['data'][0]
+            if start <= address < start + buf.nbytes:
+                return slot
+        raise PiCameraValueError('array is not a frame in use from this output')
+
+    def truncate(self, size=None):
+        """
+        Discards any partially written frame, and releases all frames.
+        """
+        with self._lock:
+            self._current = None
+            self._pos = self._length = 0
+            self._free.extend(self._used)
+            self._used.clear()
+        self.array = None
+
+    def close(self):
+        self.truncate()
+        super(PiPooledArrayOutput, self).close()
+
+
+class PiPooledRGBArray(PiPooledArrayOutput):
+    """
+    A variant of :class:`PiRGBArray` which captures into a ring of
+    preallocated frames; see :class:`PiPooledArrayOutput`.
+    """
+
+    def _frame_length(self, resolution):
+        fwidth, fheight = raw_resolution(resolution)
+        return fwidth * fheight * 3
+
+    def _frame_ready(self, data, resolution):
+        self.array = bytes_to_rgb(data, resolution)
+
+
+class PiPooledYUVArray(PiPooledArrayOutput):
+    """
+    A variant of :class:`PiYUVArray` which captures into a ring of
+    preallocated frames; see :class:`PiPooledArrayOutput`. Each frame is
+    provided as :attr:`planes`; :attr:`array` and :attr:`rgb_array` are
+    only constructed when read.
+    """
+
+    def __init__(self, camera, size=None, frames=2):
+        self.planes = None
+        super(PiPooledYUVArray, self).__init__(camera, size, frames)
+
+    def _frame_length(self, resolution):
+        fwidth, fheight = raw_resolution(resolution)
+        return fwidth * fheight + 2 * (fwidth // 2) * (fheight // 2)
+
+    def _frame_ready(self, data, resolution):
+        self.planes = bytes_to_yuv420(data, resolution)
+        self._array = None
         self._rgb = None
 
+    @property
+    def array(self):
+        if self._array is None and self.planes is not None:
+            self._array = self.planes.packed()
+        return self._array
+
+    @array.setter
+    def array(self, value):
+        self._array = value
+        self._rgb = None
+        self.planes = None
+
     @property
     def rgb_array(self):
-        if self._rgb is None:
-            # Apply the standard biases
-            YUV = self.array.astype(float)
-            YUV[:, :, 0]  = YUV[:, :, 0]  - 16  # Offset Y by 16
-            YUV[:, :, 1:] = YUV[:, :, 1:] - 128 # Offset UV by 128
-            # YUV conversion matrix from ITU-R BT.601 version (SDTV)
-            #              Y       U       V
-            M = np.array([[1.164,  0.000,  1.596],    # R
-                          [1.164, -0.392, -0.813],    # G
-                          [1.164,  2.017,  0.000]])   # B
-
-            self._rgb = YUV.dot(M.T).clip(0, 255).astype(np.uint8)
+        if self._rgb is None and self.planes is not None:
+            self._rgb = yuv_to_rgb(self.planes)
         return self._rgb
 
 
+def _raw10_lut():
+    # Each group of four RAW10 pixels is packed as their high 8 bits in four
+    # bytes followed by a fifth byte of low bits. This table expands each
+    # value of the fifth byte to the low bits of the four pixels (as four
+    # uint16 values viewed as one uint64), distributed as by the original
+    # shift-and-OR unpacking: pixel n receives bits 2n-2 and 2n-1 of the
+    # byte, and the first pixel none
+    shifts = np.array([0, 0, 2, 4], dtype=np.uint16)
+    masks = np.array([0, 3, 3, 3], dtype=np.uint16)
+    lut = (np.arange(256, dtype=np.uint16)[:, np.newaxis] >> shifts) & masks
+    return lut.view(np.uint64).reshape(256)
+
+_RAW10_LUT = _raw10_lut()
+
+
+def _unpack_raw10_band(rows, out):
+    groups = rows.reshape((rows.shape[0], -1, 5))
+    np.left_shift(
+        groups[..., :4], 2, out=out.reshape((out.shape[0], -1, 4)),
+        dtype=np.uint16)
+    out = out.view(np.uint64)
+    np.bitwise_or(out, _RAW10_LUT[groups[..., 4]], out=out)
+
+
+def unpack_raw10(
+        data, width, height, stride=None, out=None, executor=None, bands=4):
+    """
+    Unpacks the RAW10 Bayer data in *data* (any object supporting the
+    buffer protocol) to a (*height*, *width*) array of 16-bit values.
+
+    *width* must be a multiple of 4, and *stride* is the number of bytes
+    from the start of one row to the next (by default, the row is not
+    padded). If *out* is specified, it must be a C-contiguous uint16 array
+    of the right shape, and is filled and returned. If *executor* (a
+    :class:`~concurrent.futures.Executor`) is specified, the rows are
+    unpacked in *bands* bands in parallel.
+    """
+    if width % 4:
+        raise PiCameraValueError('width must be a multiple of 4')
+    row_bytes = width * 5 // 4
+    if stride is None:
+        stride = row_bytes
+    try:
+        rows = np.frombuffer(data, dtype=np.uint8, count=height * stride)
+    except ValueError:
+        raise PiCameraValueError(
+            'Incorrect buffer length for resolution %dx%d' % (width, height))
+    rows = rows.reshape((height, stride))[:, :row_bytes]
+    if out is None:
+        out = np.empty((height, width), dtype=np.uint16)
+    elif (
+            out.shape != (height, width) or out.dtype != np.uint16 or
+            not out.flags.c_contiguous):
+        raise PiCameraValueError(
+            'out must be a contiguous %dx%d uint16 array' % (width, height))
+    if executor is None or bands < 2 or height < bands:
+        _unpack_raw10_band(rows, out)
+    else:
+        step = (height + bands - 1) // bands
+        for future in [
+                executor.submit(
+                    _unpack_raw10_band, rows[i:i + step], out[i:i + step])
+                for i in range(0, height, step)
+                ]:
+            future.result()
+    return out
+
+
+def _window_counts(length, parity):
+    # For each position along an axis, the number of positions in the
+    # 3-wide window around it (within the axis) with the given parity
+    counts = np.zeros(length + 2, dtype=np.uint16)
+    counts[1 + parity:length + 1:2] = 1
+    return counts[:-2] + counts[1:-1] + counts[2:]
+
+
+def _demosaic_tile(array, planes, counts, out, start, stop):
+    height, width = array.shape[:2]
+    row_counts, col_counts = counts
+    top, bottom = max(start - 1, 0), min(stop + 1, height)
+    # The tile's rows plus a halo row above and below, and a zero border
+    # column either side; halo rows outside the image remain zero
+    padded = np.zeros((stop - start + 2, width + 2), dtype=np.uint16)
+    rows = slice(top - start + 1, bottom - start + 1)
+    across = np.empty((padded.shape[0], width), dtype=np.uint16)
+    for channel, positions in enumerate(planes):
+        if array.ndim == 3:
+            padded[rows, 1:-1] = array[top:bottom, :, channel]
+        else:
+            padded[...] = 0
+            for y, x in positions:
+                first = top + (y - top) % 2
+                padded[first - start + 1:bottom - start + 1:2, 1 + x:-1:2] = \
+                    array[first:bottom:2, x::2]
+        # Sum each 3x3 window as a horizontal then a vertical 3-tap sum
+        np.add(padded[:, :-2], padded[:, 1:-1], out=across)
+        np.add(across, padded[:, 2:], out=across)
+        total = across[:-2] + across[1:-1]
+        total += across[2:]
+        count = sum(
+            row_counts[y][start:stop, np.newaxis] * col_counts[x]
+            for y, x in positions)
+        np.floor_divide(total, count, out=out[start:stop, :, channel])
+
+
+def demosaic_bayer(
+        array, bayer_order, out=None, executor=None, tile_rows=128):
+    """
+    Demosaics the Bayer data in *array*, which may be a 2D array of sensor
+    values or the 3D representation produced by :class:`PiBayerArray`, with
+    the specified *bayer_order*. Each channel of the result is the average
+    of the values of that color in the 3x3 window around each pixel, as
+    produced by :meth:`PiBayerArray.demosaic`.
+
+    The rows are processed in tiles of *tile_rows* rows, so temporary
+    memory is bounded by the tile size. If *out* is specified, it must be a
+    (height, width, 3) uint16 array and is filled and returned. If
+    *executor* (a :class:`~concurrent.futures.Executor`) is specified, the
+    tiles are processed in parallel.
+    """
+    height, width = array.shape[:2]
+    if out is None:
+        out = np.empty((height, width, 3), dtype=np.uint16)
+    elif out.shape != (height, width, 3) or out.dtype != np.uint16:
+        raise PiCameraValueError(
+            'out must be a %dx%dx3 uint16 array' % (width, height))
+    try:
+        red, green1, green2, blue = PiBayerArray.BAYER_OFFSETS[bayer_order]
+    except KeyError:
+        raise PiCameraValueError('Invalid bayer_order %s' % bayer_order)
+    planes = ((red,), (green1, green2), (blue,))
+    counts = (
+        [_window_counts(height, parity) for parity in (0, 1)],
+        [_window_counts(width, parity) for parity in (0, 1)],
+        )
+    tiles = [
+        (start, min(start + tile_rows, height))
+        for start in range(0, height, tile_rows)
+        ]
+    if executor is None:
+        for start, stop in tiles:
+            _demosaic_tile(array, planes, counts, out, start, stop)
+    else:
+        for future in [
+                executor.submit(
+                    _demosaic_tile, array, planes, counts, out, start, stop)
+                for start, stop in tiles
+                ]:
+            future.result()
+    return out
+
+
 class BroadcomRawHeader(ct.Structure):
     _fields_ = [
         ('name',          ct.c_char * 32),
@@ -194,20 +730,38 @@ class PiBayerArray(PiArrayOutput):
         3: ((0, 1), (1, 1), (0, 0), (1, 0)),
         }
 
-    def __init__(self, camera, output_dims=3):
+    def __init__(self, camera, output_dims=3, threads=1):
         super(PiBayerArray, self).__init__(camera, size=None)
         if not (2 <= output_dims <= 3):
             raise PiCameraValueError('output_dims must be 2 or 3')
+        if threads < 1:
+            raise PiCameraValueError('threads must be at least 1')
         self._demo = None
         self._header = None
+        # The unpacked data, and its 3-plane form as a (bayer_order, array)
+        # tuple, are reused from capture to capture while the resolution (and
+        # Bayer order) is unchanged; hence array is overwritten by the next
+        # capture
+        self._raw = None
+        self._planes = None
         self._output_dims = output_dims
+        self._threads = threads
+        self._executor = ThreadPoolExecutor(threads) if threads > 1 else None
+
+    def close(self):
+        super(PiBayerArray, self).close()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
 
     @property
     def output_dims(self):
         return self._output_dims
 
-    def _to_3d(self, array):
-        array_3d = np.zeros(array.shape + (3,), dtype=array.dtype)
+    def _to_3d(self, array, array_3d=None):
+        # If *array_3d* is given, it must be zero bar the positions filled
+        if array_3d is None:
+            array_3d = np.zeros(array.shape + (3,), dtype=array.dtype)
         (
             (ry, rx), (gy, gx), (Gy, Gx), (by, bx)
             ) = PiBayerArray.BAYER_OFFSETS[self._header.bayer_order]
@@ -242,89 +796,116 @@ class PiBayerArray(PiArrayOutput):
                 7: 445440,
                 },
             }[self.camera.revision.upper()][self.camera.sensor_mode]
-        data = self.getvalue()[-offset:]
-        if data[:4] != b'BRCM':
-            raise PiCameraValueError('Unable to locate Bayer data at end of buffer')
-      rom_buffer_copy(
-            data[176:176 + ct.sizeof(BroadcomRawHeader)])
-        data = np.frombuffer(data, dtype=np.uint8, offset=32768)
-
-        crop = mo.PiResolution(
-            self._header.width * 5 // 4,
-            self._header.height)
-        shape = mo.PiResolution(
-            (((self._header.width + self._header.padding_right) * 5) + 3) // 4,
-            (self._header.height + self._header.padding_down)
-            ).pad()
-        data = data.reshape((shape.height, shape.width))[:crop.height, :crop.width]
-
-        data = data.astype(np.uint16) << 2
-        for byte in range(4):
-            data[:, byte::5] |= ((data[:, 4::5] >> (byte * 2)) & 3)
-        self.array = np.zeros(
-            (data.shape[0], data.shape[1] * 4 // 5), dtype=np.uint16)
-        for i in range(4):
-            self.array[:, i::4] = data[:, i::5]
+        # Look at the end of the stream through a view rather than copying
+        # all of it; the view must be released before the stream is written
+        # to again
+        try:
+            buf = self.getbuffer()
+        except AttributeError:
+            # Py2.7's BytesIO lacks getbuffer
+            buf = memoryview(self.getvalue())
+        data = None
+        try:
+            data = buf[-offset:]
+            if data[:4].tobytes() != b'BRCM':
+                raise PiCameraValueError('Unable to locate Bayer data at end of buffer')
+            self._header = BroadcomRawHeader.from_buffer_copy(
+                data[176:176 + ct.sizeof(BroadcomRawHeader)])
+
+            shape = mo.PiResolution(
+                (((self._header.width + self._header.padding_right) * 5) + 3) // 4,
+                (self._header.height + self._header.padding_down)
+                ).pad()
+            size = (self._header.height, self._header.width)
+            if self._raw is None or self._raw.shape != size:
+                self._raw = np.empty(size, dtype=np.uint16)
+                self._planes = None
+            self.array = unpack_raw10(
+                data[32768:], self._header.width, self._header.height,
+                stride=shape.width, out=self._raw, executor=self._executor,
+                bands=self._threads)
+        finally:
+            data = None
+            try:
+                buf.release()
+            except AttributeError:
+                pass
         if self.output_dims == 3:
-            self.array = self._to_3d(self.array)
+            order = self._header.bayer_order
+            if self._planes is None or self._planes[0] != order:
+                self._planes = (
+                    order, np.zeros(self._raw.shape + (3,), dtype=np.uint16))
+            self.array = self._to_3d(self.array, self._planes[1])
 
-    def demosaic(self):
+    def demosaic(self, reference=False):
         """
 
+        The result is computed by :func:`demosaic_bayer`, in parallel if
+        *threads* was specified. If *reference* is ``True``, it is instead
+        computed (without caching) by the original whole-frame
+        implementation, for comparison.
         """
+        if reference:
+            return self._demosaic_reference()
         if self._demo is None:
-            # Construct 3D representation of Bayer data (if necessary)
-            if self.output_dims == 2:
-                array_3d = self._to_3d(self.array)
-            else:
-                array_3d = self.array
-            # Construct representation of the bayer pattern
-            bayer = np.zeros(array_3d.shape, dtype=np.uint8)
-            (
-                (ry, rx), (gy, gx), (Gy, Gx), (by, bx)
-                ) = PiBayerArray.BAYER_OFFSETS[self._header.bayer_order]
-            bayer[ry::2, rx::2, 0] = 1 # Red
-            bayer[gy::2, gx::2, 1] = 1 # Green
-            bayer[Gy::2, Gx::2, 1] = 1 # Green
-            bayer[by::2, bx::2, 2] = 1 # Blue
-
-            window = (3, 3)
-            borders = (window[0] - 1, window[1] - 1)
-            border = (borders[0] // 2, borders[1] // 2)
-
-            rgb = np.zeros((
-                array_3d.shape[0] + borders[0],
-                array_3d.shape[1] + borders[1],
-                array_3d.shape[2]), dtype=array_3d.dtype)
-            rgb[
-                border[0]:rgb.shape[0] - border[0],
-                border[1]:rgb.shape[1] - border[1],
-                :] = array_3d
-            bayer_pad = np.zeros((
-                array_3d.shape[0] + borders[0],
-                array_3d.shape[1] + borders[1],
-                array_3d.shape[2]), dtype=bayer.dtype)
-            bayer_pad[
-                border[0]:bayer_pad.shape[0] - border[0],
-                border[1]:bayer_pad.shape[1] - border[1],
-                :] = bayer
-            bayer = bayer_pad
-
-            self._demo = np.empty(array_3d.shape, dtype=array_3d.dtype)
-            for plane in range(3):
-                p = rgb[..., plane]
-                b = bayer[..., plane]
-                pview = as_strided(p, shape=(
-                    p.shape[0] - borders[0],
-                    p.shape[1] - borders[1]) + window, strides=p.strides * 2)
-                bview = as_strided(b, shape=(
-                    b.shape[0] - borders[0],
-                    b.shape[1] - borders[1]) + window, strides=b.strides * 2)
-                psum = np.einsum('ijkl->ij', pview)
-                bsum = np.einsum('ijkl->ij', bview)
-                self._demo[..., plane] = psum // bsum
+            self._demo = demosaic_bayer(
+                self.array, self._header.bayer_order,
+                executor=self._executor)
         return self._demo
 
+    def _demosaic_reference(self):
+        # Construct 3D representation of Bayer data (if necessary)
+        if self.output_dims == 2:
+            array_3d = self._to_3d(self.array)
+        else:
+            array_3d = self.array
+        # Construct representation of the bayer pattern
+        bayer = np.zeros(array_3d.shape, dtype=np.uint8)
+        (
+            (ry, rx), (gy, gx), (Gy, Gx), (by, bx)
+            ) = PiBayerArray.BAYER_OFFSETS[self._header.bayer_order]
+        bayer[ry::2, rx::2, 0] = 1 # Red
+        bayer[gy::2, gx::2, 1] = 1 # Green
+        bayer[Gy::2, Gx::2, 1] = 1 # Green
+        bayer[by::2, bx::2, 2] = 1 # Blue
+
+        window = (3, 3)
+        borders = (window[0] - 1, window[1] - 1)
+        border = (borders[0] // 2, borders[1] // 2)
+
+        rgb = np.zeros((
+            array_3d.shape[0] + borders[0],
+            array_3d.shape[1] + borders[1],
+            array_3d.shape[2]), dtype=array_3d.dtype)
+        rgb[
+            border[0]:rgb.shape[0] - border[0],
+            border[1]:rgb.shape[1] - border[1],
+            :] = array_3d
+        bayer_pad = np.zeros((
+            array_3d.shape[0] + borders[0],
+            array_3d.shape[1] + borders[1],
+            array_3d.shape[2]), dtype=bayer.dtype)
+        bayer_pad[
+            border[0]:bayer_pad.shape[0] - border[0],
+            border[1]:bayer_pad.shape[1] - border[1],
+            :] = bayer
+        bayer = bayer_pad
+
+        demo = np.empty(array_3d.shape, dtype=array_3d.dtype)
+        for plane in range(3):
+            p = rgb[..., plane]
+            b = bayer[..., plane]
+            pview = as_strided(p, shape=(
+                p.shape[0] - borders[0],
+                p.shape[1] - borders[1]) + window, strides=p.strides * 2)
+            bview = as_strided(b, shape=(
+                b.shape[0] - borders[0],
+                b.shape[1] - borders[1]) + window, strides=b.strides * 2)
+            psum = np.einsum('ijkl->ij', pview)
+            bsum = np.einsum('ijkl->ij', bview)
+            demo[..., plane] = psum // bsum
+        return demo
+
 
 class PiMotionArray(PiArrayOutput):
     """
@@ -391,11 +972,22 @@ class PiRGBAnalysis(PiAnalysisOutput):
 class PiYUVAnalysis(PiAnalysisOutput):
     """
 
+    If *planar* is ``True``, :meth:`analyze` is passed a
+    :class:`PiYUVPlanes` object instead of a (height, width, 3) array. Its
+    planes are views of the encoder's buffer, so must be copied if they are
+    needed after :meth:`analyze` returns.
     """
 
+    def __init__(self, camera, size=None, planar=False):
+        super(PiYUVAnalysis, self).__init__(camera, size)
+        self.planar = planar
+
     def write(self, b):
         result = super(PiYUVAnalysis, self).write(b)
-        self.analyze(bytes_to_yuv(b, self.size or self.camera.resolution))
+        if self.planar:
+            self.analyze(bytes_to_yuv420(b, self.size or self.camera.resolution))
+        else:
+            self.analyze(bytes_to_yuv(b, self.size or self.camera.resolution))
         return result
 
 
@@ -0,0 +1,1114 @@
+from __future__ import (
+    unicode_literals,
+    print_function,
+    division,
+    absolute_import,
+    )
+
+# Make Py2's str equivalent to Py3's
+native_str = str
+str = type('')
+
+
+import io
+import os
+import struct
+from array import array
+from bisect import bisect_right
+from collections import namedtuple
+from threading import RLock
+from concurrent.futures import ThreadPoolExecutor
+
+from picamera.exc import PiCameraValueError
+from picamera.frames import PiVideoFrameType
+
+
+try:
+    array(native_str('q'))
+except ValueError:
+    # Py2.7 has no 64-bit integer typecode; doubles hold integers exactly up
+    # to 2**53 (ample for byte offsets and timestamps in microseconds) but
+    # values must be converted back with int() when they are read
+    _INT64 = native_str('d')
+else:
+    _INT64 = native_str('q')
+
+# os.rename doesn't replace an existing file on Windows, and Py2.7 lacks
+# os.replace
+_replace = getattr(os, 'replace', os.rename)
+
+
+def _crc32_table():
+    table = []
+    for i in range(256):
+        crc = i << 24
+        for bit in range(8):
+            if crc & 0x80000000:
+                crc = (crc << 1) ^ 0x04C11DB7
+            else:
+                crc <<= 1
+        table.append(crc & 0xFFFFFFFF)
+    return table
+
+_CRC32_TABLE = _crc32_table()
+
+
+def _crc32_mpeg(data):
+    # The (unreflected) CRC-32 variant used by MPEG-2 PSI tables, which
+    # differs from zlib's
+    crc = 0xFFFFFFFF
+    for byte in bytearray(data):
+        crc = ((crc << 8) & 0xFFFFFFFF) ^ _CRC32_TABLE[(crc >> 24) ^ byte]
+    return crc
+
+
+def _write_atomic(filename, data):
+    # Write *data* to *filename* such that readers see either the old or the
+    # new content, never a partial file
+    temp = filename + '.tmp'
+    with io.open(temp, 'wb') as f:
+        f.write(data)
+    _replace(temp, filename)
+
+
+class PiMPEGTSMuxer(object):
+    """
+    Wraps H.264 access units in an MPEG transport stream containing a single
+    program with a single video elementary stream.
+
+    Call :meth:`write_tables` at the start of the stream (and of each segment
+    if the stream is divided), followed by :meth:`write_frame` for each
+    access unit. All output is written to *output* in whole 188-byte
+    packets, with one write per call.
+    """
+
+    PAT_PID = 0x0000
+    PMT_PID = 0x1000
+    VIDEO_PID = 0x0100
+    STREAM_TYPE_H264 = 0x1B
+    # Presentation times are offset from the timestamps of the frames so
+    # that the PCR, which must not be ahead of them, is never negative
+    PTS_OFFSET = 90000
+    PCR_DELAY = 9000
+    ACCESS_UNIT_DELIMITER = b'\x00\x00\x00\x01\x09\xf0'
+
+    def __init__(self, output):
+        self.output = output
+        self._counters = {}
+
+    def _packets(self, pid, payload, pcr=None, random_access=False):
+        # Split *payload* into transport stream packets for *pid*, the first
+        # of which starts a payload unit and carries *pcr*, if given
+        result = bytearray()
+        view = memoryview(payload)
+        pos = 0
+        first = True
+        while first or pos < len(payload):
+            body = bytearray()
+            if first and pcr is not None:
+                body.append(0x10 | (0x40 if random_access else 0))
+                base = pcr & 0x1FFFFFFFF
+                body.extend((
+                    (base >> 25) & 0xFF, (base >> 17) & 0xFF,
+                    (base >> 9) & 0xFF, (base >> 1) & 0xFF,
+                    ((base & 1) << 7) | 0x7E, 0x00))
+            remaining = len(payload) - pos
+            if body:
+                size = min(remaining, 183 - len(body))
+            else:
+                size = min(remaining, 184)
+            counter = self._counters.get(pid, 0)
+            self._counters[pid] = (counter + 1) & 0x0F
+            result.extend((
+                0x47, (0x40 if first else 0) | (pid >> 8), pid & 0xFF))
+            if size < 184:
+                # Adaptation field: the length byte, the flags (if there's
+                # room), the PCR (if any), then stuffing
+                length = 183 - size
+                result.append(0x30 | counter)
+                result.append(length)
+                if length:
+                    result.extend(body or b'\x00')
+                    result.extend(b'\xff' * (length - max(1, len(body))))
+            else:
+                result.append(0x10 | counter)
+            result += view[pos:pos + size]
+            pos += size
+            first = False
+        return result
+
+    def _section(self, table_id, content):
+        # Wrap *content* in a PSI section with a CRC, preceded by the pointer
+        # field
+        section = bytearray((
+            table_id, 0xB0 | ((len(content) + 9) >> 8),
+            (len(content) + 9) & 0xFF, 0x00, 0x01, 0xC1, 0x00, 0x00))
+        section.extend(content)
+        crc = _crc32_mpeg(section)
+        section.extend((
+            crc >> 24, (crc >> 16) & 0xFF, (crc >> 8) & 0xFF, crc & 0xFF))
+        return b'\x00' + bytes(section)
+
+    def write_tables(self):
+        """
+        Write the program association and program map tables.
+        """
+        pat = self._section(0x00, bytearray((
+            0x00, 0x01, 0xE0 | (self.PMT_PID >> 8), self.PMT_PID & 0xFF)))
+        pmt = self._section(0x02, bytearray((
+            0xE0 | (self.VIDEO_PID >> 8), self.VIDEO_PID & 0xFF, 0xF0, 0x00,
+            self.STREAM_TYPE_H264,
+            0xE0 | (self.VIDEO_PID >> 8), self.VIDEO_PID & 0xFF, 0xF0, 0x00)))
+        data = self._packets(self.PAT_PID, pat)
+        data.extend(self._packets(self.PMT_PID, pmt))
+        self.output.write(data)
+
+    def write_frame(self, data, timestamp, key_frame=False):
+        """
+        Write the H.264 access unit *data* (in Annex-B format, without an
+        access unit delimiter) presented at *timestamp* microseconds. If
+        *key_frame* is ``True`` the frame is marked as a random access point.
+        """
+        pts = (timestamp * 9 // 100 + self.PTS_OFFSET) & 0x1FFFFFFFF
+        pes = bytearray((
+            0x00, 0x00, 0x01, 0xE0, 0x00, 0x00, 0x80, 0x80, 0x05,
+            0x21 | ((pts >> 29) & 0x0E), (pts >> 22) & 0xFF,
+            ((pts >> 14) & 0xFE) | 1, (pts >> 7) & 0xFF,
+            ((pts << 1) & 0xFE) | 1))
+        pes.extend(self.ACCESS_UNIT_DELIMITER)
+        pes.extend(data)
+        self.output.write(self._packets(
+            self.VIDEO_PID, pes, pts - self.PCR_DELAY, key_frame))
+
+
+def _nal_units(data):
+    # Return a list of memoryviews of the NAL units in *data*, which is in
+    # Annex-B format, excluding their start codes
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    view = memoryview(data)
+    starts = []
+    pos = data.find(b'\x00\x00\x01')
+    while pos != -1:
+        starts.append(pos + 3)
+        pos = data.find(b'\x00\x00\x01', pos + 3)
+    result = []
+    for i, start in enumerate(starts):
+        end = starts[i + 1] - 3 if i + 1 < len(starts) else len(data)
+        # Trailing zeros belong to the next (4-byte) start code
+        while end > start and view[end - 1:end] == b'\x00':
+            end -= 1
+        if end > start:
+            result.append(view[start:end])
+    return result
+
+
+def _nal_type(nal):
+    return bytearray(nal[:1])[0] & 0x1F
+
+
+class _BitReader(object):
+    # Reads the fields of an H.264 RBSP (i.e. a NAL unit with emulation
+    # prevention bytes removed)
+    def __init__(self, data):
+        self._data = bytearray(data)
+        self._pos = 0
+
+    def u(self, bits):
+        result = 0
+        for i in range(bits):
+            byte = self._data[self._pos >> 3]
+            result = (result << 1) | ((byte >> (7 - (self._pos & 7))) & 1)
+            self._pos += 1
+        return result
+
+    def ue(self):
+        zeros = 0
+        while not self.u(1):
+            zeros += 1
+        return (1 << zeros) - 1 + self.u(zeros)
+
+    def se(self):
+        value = self.ue()
+        return (value + 1) // 2 if value & 1 else -(value // 2)
+
+
+def _parse_sps(sps):
+    # Return a dict of the fields of the H.264 SPS NAL unit *sps* that are
+    # needed to describe the stream in a container
+    rbsp = bytes(sps).replace(b'\x00\x00\x03', b'\x00\x00')
+    reader = _BitReader(rbsp[1:])
+    result = {
+        'profile': reader.u(8),
+        'compatibility': reader.u(8),
+        'level': reader.u(8),
+        'chroma_format': 1,
+        'bit_depth_luma': 8,
+        'bit_depth_chroma': 8,
+        }
+    reader.ue() # seq_parameter_set_id
+    if result['profile'] in (
+            100, 110, 122, 244, 44, 83, 86, 118, 128, 138, 139, 134, 135):
+        result['chroma_format'] = reader.ue()
+        if result['chroma_format'] == 3:
+            reader.u(1) # separate_colour_plane_flag
+        result['bit_depth_luma'] = reader.ue() + 8
+        result['bit_depth_chroma'] = reader.ue() + 8
+        reader.u(1) # qpprime_y_zero_transform_bypass_flag
+        if reader.u(1): # seq_scaling_matrix_present_flag
+            for i in range(8 if result['chroma_format'] != 3 else 12):
+                if reader.u(1):
+                    last = scale = 8
+                    for j in range(16 if i < 6 else 64):
+                        if scale:
+                            scale = (last + reader.se()) % 256
+                        last = scale or last
+    reader.ue() # log2_max_frame_num_minus4
+    poc_type = reader.ue()
+    if poc_type == 0:
+        reader.ue() # log2_max_pic_order_cnt_lsb_minus4
+    elif poc_type == 1:
+        reader.u(1) # delta_pic_order_always_zero_flag
+        reader.se() # offset_for_non_ref_pic
+        reader.se() # offset_for_top_to_bottom_field
+        for i in range(reader.ue()):
+            reader.se() # offset_for_ref_frame
+    reader.ue() # max_num_ref_frames
+    reader.u(1) # gaps_in_frame_num_value_allowed_flag
+    width = (reader.ue() + 1) * 16
+    height = reader.ue() + 1
+    frame_mbs_only = reader.u(1)
+    height *= 16 * (2 - frame_mbs_only)
+    if not frame_mbs_only:
+        reader.u(1) # mb_adaptive_frame_field_flag
+    reader.u(1) # direct_8x8_inference_flag
+    if reader.u(1): # frame_cropping_flag
+        left, right, top, bottom = (reader.ue() for i in range(4))
+        width -= (left + right) * 2
+        height -= (top + bottom) * 2 * (2 - frame_mbs_only)
+    result['width'] = width
+    result['height'] = height
+    return result
+
+
+def _box(kind, *payload):
+    size = 8 + sum(len(p) for p in payload)
+    return b''.join((struct.pack('>I', size), kind) + payload)
+
+
+def _full_box(kind, version, flags, *payload):
+    return _box(kind, struct.pack('>I', (version << 24) | flags), *payload)
+
+
+_MATRIX = struct.pack('>9I', 0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000)
+
+
+class PiMP4Muxer(object):
+    """
+    Writes H.264 access units to *output* as a fragmented MP4 file.
+
+    Pass each access unit (in Annex-B format, as produced by the encoder) to
+    :meth:`write_frame`. The initialization segment (the ``ftyp`` and
+    ``moov`` boxes) is written once the stream's SPS and PPS headers and its
+    first key frame have been seen; frames before that are discarded. Each
+    group of pictures is then written as a fragment (a ``moof`` and
+    ``mdat`` box) once the next key frame arrives, or when :meth:`close` is
+    called, so no more than one GOP is held in memory. Sample durations are
+    derived from the frames' timestamps, in units of 1/*timescale* seconds.
+
+    :meth:`close` does not close *output*.
+    """
+
+    TRACK_ID = 1
+    KEY_FRAME_FLAGS = 0x02000000
+    FRAME_FLAGS = 0x01010000
+
+    def __init__(self, output, timescale=90000):
+        self.output = output
+        self.timescale = timescale
+        self._sps = None
+        self._pps = None
+        self._started = False
+        self._base = None
+        self._sequence = 0
+        self._samples = []
+        self._last_duration = timescale // 30
+
+    def write_frame(self, data, timestamp, key_frame=False):
+        """
+        Add the access unit *data*, presented at *timestamp* microseconds.
+        SPS and PPS headers are recorded; other NAL units (bar access unit
+        delimiters) form the frame's sample. If *key_frame* is ``True`` the
+        frame begins a new fragment.
+        """
+        sample = []
+        for nal in _nal_units(data):
+            nal_type = _nal_type(nal)
+            if nal_type == 7:
+                self._sps = nal.tobytes()
+            elif nal_type == 8:
+                self._pps = nal.tobytes()
+            elif nal_type != 9:
+                sample.append(struct.pack('>I', len(nal)))
+                sample.append(nal.tobytes())
+        if not sample:
+            return
+        if not self._started:
+            if not (key_frame and self._sps and self._pps):
+                return
+            self._write_init()
+            self._started = True
+            self._base = timestamp
+        elif key_frame:
+            self._write_fragment(timestamp)
+        self._samples.append((b''.join(sample), key_frame, timestamp))
+
+    def close(self):
+        """
+        Write the final fragment.
+        """
+        if self._samples:
+            self._write_fragment(None)
+
+    def _decode_time(self, timestamp):
+        return (timestamp - self._base) * self.timescale // 1000000
+
+    def _write_init(self):
+        info = _parse_sps(self._sps)
+        width, height = info['width'], info['height']
+        avcc = bytearray((
+            1, info['profile'], info['compatibility'], info['level'],
+            0xFF, 0xE1))
+        avcc.extend(struct.pack('>H', len(self._sps)))
+        avcc.extend(self._sps)
+        avcc.append(1)
+        avcc.extend(struct.pack('>H', len(self._pps)))
+        avcc.extend(self._pps)
+        if info['profile'] in (100, 110, 122, 244):
+            avcc.extend((
+                0xFC | info['chroma_format'],
+                0xF8 | (info['bit_depth_luma'] - 8),
+                0xF8 | (info['bit_depth_chroma'] - 8),
+                0))
+        avc1 = _box(
+            b'avc1',
+            b'\x00' * 6 + struct.pack('>H', 1) + b'\x00' * 16,
+            struct.pack('>HHIIIH', width, height, 0x480000, 0x480000, 0, 1),
+            b'\x00' * 32 + struct.pack('>Hh', 0x18, -1),
+            _box(b'avcC', bytes(avcc)))
+        empty = struct.pack('>I', 0)
+        stbl = _box(
+            b'stbl',
+            _full_box(b'stsd', 0, 0, struct.pack('>I', 1), avc1),
+            _full_box(b'stts', 0, 0, empty),
+            _full_box(b'stsc', 0, 0, empty),
+            _full_box(b'stsz', 0, 0, empty, empty),
+            _full_box(b'stco', 0, 0, empty))
+        minf = _box(
+            b'minf',
+            _full_box(b'vmhd', 0, 1, b'\x00' * 8),
+            _box(b'dinf', _full_box(
+                b'dref', 0, 0, struct.pack('>I', 1),
+                _full_box(b'url ', 0, 1))),
+            stbl)
+        mdia = _box(
+            b'mdia',
+            _full_box(
+                b'mdhd', 0, 0,
+                struct.pack('>IIIIHH', 0, 0, self.timescale, 0, 0x55C4, 0)),
+            _full_box(
+                b'hdlr', 0, 0, struct.pack('>I', 0), b'vide',
+                b'\x00' * 12, b'VideoHandler\x00'),
+            minf)
+        trak = _box(
+            b'trak',
+            _full_box(
+                b'tkhd', 0, 3,
+                struct.pack('>IIIII', 0, 0, self.TRACK_ID, 0, 0),
+                b'\x00' * 8, struct.pack('>hhhH', 0, 0, 0, 0), _MATRIX,
+                struct.pack('>II', width << 16, height << 16)),
+            mdia)
+        moov = _box(
+            b'moov',
+            _full_box(
+                b'mvhd', 0, 0,
+                struct.pack('>IIIIIH', 0, 0, 1000, 0, 0x10000, 0x100),
+                b'\x00' * 10, _MATRIX, b'\x00' * 24,
+                struct.pack('>I', self.TRACK_ID + 1)),
+            trak,
+            _box(b'mvex', _full_box(
+                b'trex', 0, 0,
+                struct.pack('>IIIII', self.TRACK_ID, 1, 0, 0, 0))))
+        ftyp = _box(
+            b'ftyp', b'iso5', struct.pack('>I', 512),
+            b'iso5', b'iso6', b'avc1', b'mp41')
+        self.output.write(ftyp + moov)
+
+    def _write_fragment(self, next_timestamp):
+        samples, self._samples = self._samples, []
+        self._sequence += 1
+        times = [self._decode_time(timestamp) for _, _, timestamp in samples]
+        if next_timestamp is not None:
+            times.append(self._decode_time(next_timestamp))
+        else:
+            times.append(times[-1] + self._last_duration)
+        entries = []
+        for i, (data, key_frame, _) in enumerate(samples):
+            # Timestamps can repeat (when the encoder doesn't know the time
+            # of a frame); ensure every sample has some duration
+            duration = max(1, times[i + 1] - times[i])
+            entries.append(struct.pack(
+                '>III', duration, len(data),
+                self.KEY_FRAME_FLAGS if key_frame else self.FRAME_FLAGS))
+        self._last_duration = duration
+        # The data offset is from the start of the moof box to the first
+        # sample; the moof's size is known in advance so it is computed here
+        traf_size = 8 + 16 + 20 + (20 + len(entries) * 12)
+        moof_size = 8 + 16 + traf_size
+        moof = _box(
+            b'moof',
+            _full_box(b'mfhd', 0, 0, struct.pack('>I', self._sequence)),
+            _box(
+                b'traf',
+                _full_box(
+                    b'tfhd', 0, 0x020000, struct.pack('>I', self.TRACK_ID)),
+                _full_box(
+                    b'tfdt', 1, 0, struct.pack('>Q', max(0, times[0]))),
+                _full_box(
+                    b'trun', 0, 0x000701,
+                    struct.pack('>Ii', len(entries), moof_size + 8),
+                    *entries)))
+        assert len(moof) == moof_size
+        size = 8 + sum(len(data) for data, _, _ in samples)
+        self.output.write(b''.join(
+            [moof, struct.pack('>I', size), b'mdat'] +
+            [data for data, _, _ in samples]))
+
+
+class PiCameraFrameOutput(object):
+    """
+    Base class for outputs which assemble the buffers of an H.264 recording
+    into whole frames (access units) using the meta-data of the encoder on
+    *splitter_port* of *camera*.
+
+    Descendents override :meth:`_write_frame`, which is called with each
+    complete frame, and should call :meth:`close` of this class when they
+    are closed.
+    """
+    def __init__(self, camera, splitter_port=1):
+        try:
+            camera._encoders
+        except AttributeError:
+            raise PiCameraValueError('camera must be a valid PiCamera object')
+        self.camera = camera
+        self.splitter_port = splitter_port
+        self._lock = RLock()
+        self._closed = False
+        self._header = bytearray()
+        self._frame = bytearray()
+        self._last_timestamp = None
+        self._interval = 0
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def write(self, b):
+        """
+        Add *b*, a buffer of H.264 output, to the current frame.
+        """
+        with self._lock:
+            if self._closed:
+                raise ValueError('I/O operation on closed output')
+            encoder = self.camera._encoders[self.splitter_port]
+            try:
+                frame = encoder._frame_state
+            except AttributeError:
+                frame = encoder.frame
+            frame_type = frame[1]
+            if frame_type == PiVideoFrameType.sps_header:
+                self._header.extend(b)
+            elif frame_type in (
+                    PiVideoFrameType.key_frame, PiVideoFrameType.frame):
+                self._frame.extend(b)
+                if frame[6]:
+                    timestamp = frame[5]
+                    if timestamp is None:
+                        timestamp = self._last_timestamp or 0
+                    header = bytes(self._header) if self._header else None
+                    del self._header[:]
+                    self._write_frame(
+                        header, self._frame,
+                        frame_type == PiVideoFrameType.key_frame, timestamp)
+                    del self._frame[:]
+                    if self._last_timestamp is not None and (
+                            timestamp > self._last_timestamp):
+                        self._interval = timestamp - self._last_timestamp
+                    self._last_timestamp = timestamp
+            return len(b)
+
+    def _write_frame(self, header, frame, key_frame, timestamp):
+        """
+        Called with each complete frame. *header* is the SPS and PPS headers
+        which preceded the frame (or ``None``), *frame* is a
+        :class:`bytearray` holding the frame (which is reused after the
+        call returns), *key_frame* indicates whether it is a key frame, and
+        *timestamp* is its presentation time in microseconds.
+        """
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self.close()
+
+
+class PiCameraHLSOutput(PiCameraFrameOutput):
+    """
+    An output which publishes an H.264 recording as an HTTP Live Streaming
+    (HLS) stream in *directory*.
+
+    Pass the instance as the output of
+    :meth:`~picamera.PiCamera.start_recording` (on the same *splitter_port*)
+    and call :meth:`close` after recording has stopped. The recording is
+    divided into MPEG transport stream segments, named by formatting
+    *segments* with the ``index`` of each segment, of *target_duration*
+    seconds; each segment begins at a key frame, and one is requested from
+    the encoder when a segment is due so that segments never outlast the
+    playlist's target duration (*target_duration* rounded up). The
+    meta-data of the encoder's frames supplies segment boundaries and
+    presentation times; the video is not re-encoded.
+
+    The playlist *playlist* lists the most recent *window* segments and is
+    replaced atomically each time a segment is completed. Segments which
+    have left the playlist are deleted, bar the most recent of them (for
+    the sake of clients which have just read the previous playlist). When
+    the output is closed the final segment is added to the playlist and the
+    playlist is ended.
+
+    SPS and PPS headers are repeated at the start of each segment, so the
+    recording need not have inline headers (though it must have them at its
+    start).
+    """
+    def __init__(
+            self, camera, directory, target_duration=2, window=5,
+            playlist='index.m3u8', segments='segment{index:05d}.ts',
+            splitter_port=1):
+        if target_duration <= 0:
+            raise PiCameraValueError(
+                'target_duration must be a positive number')
+        if window < 1:
+            raise PiCameraValueError('window must be a positive integer')
+        super(PiCameraHLSOutput, self).__init__(camera, splitter_port)
+        self._directory = directory
+        self._target = int(target_duration * 1000000)
+        # The playlist's target duration (in whole seconds) is fixed, as
+        # clients may read it from the first playlist only
+        self._target_duration = int(-(-target_duration // 1))
+        self._window = window
+        self._playlist = os.path.join(directory, playlist)
+        self._segment_name = segments
+        # Completed segments as (name, duration) tuples, oldest first, and
+        # the index of the first of them
+        self._completed = []
+        self._first = 0
+        self._index = 0
+        self._file = None
+        self._muxer = None
+        self._start = None
+        self._headers = None
+        self._requested = False
+        self._control = ThreadPoolExecutor(1)
+
+    @property
+    def playlist(self):
+        """
+        Returns the filename of the playlist.
+        """
+        return self._playlist
+
+    def _segment_filename(self, index):
+        return self._segment_name.format(index=index)
+
+    def _write_frame(self, header, frame, key_frame, timestamp):
+        if header:
+            self._headers = header
+        if key_frame and self._headers:
+            if self._file is None:
+                self._open_segment(timestamp)
+            elif self._due(timestamp):
+                self._close_segment(timestamp)
+                self._open_segment(timestamp)
+        elif (
+                self._file is not None and not self._requested and
+                self._due(timestamp)):
+            # Rather than waiting for the encoder's next key frame (which
+            # could be up to an intra-period late), ask for one now; this is
+            # done from another thread as the encoder can't be reconfigured
+            # from its own callback
+            self._requested = True
+            self._control.submit(self._request_key_frame)
+        if self._file is not None:
+            if key_frame:
+                frame[:0] = self._headers
+            self._muxer.write_frame(frame, timestamp, key_frame)
+
+    def _due(self, timestamp):
+        # Returns True if the segment will reach its target with the next
+        # frame
+        return timestamp - self._start + self._interval >= self._target
+
+    def _request_key_frame(self):
+        encoder = self.camera._encoders.get(self.splitter_port)
+        if encoder is not None:
+            encoder.request_key_frame()
+
+    def _open_segment(self, timestamp):
+        self._file = io.open(
+            os.path.join(
+                self._directory, self._segment_filename(self._index)), 'wb')
+        self._muxer = PiMPEGTSMuxer(self._file)
+        self._muxer.write_tables()
+        self._start = timestamp
+        self._requested = False
+
+    def _close_segment(self, timestamp):
+        self._file.close()
+        self._file = None
+        duration = (timestamp - self._start) / 1000000
+        self._completed.append(
+            (self._segment_filename(self._index), duration))
+        self._index += 1
+        while len(self._completed) > self._window:
+            self._completed.pop(0)
+            self._first += 1
+            expired = self._first - 2
+            if expired >= 0:
+                try:
+                    os.unlink(os.path.join(
+                        self._directory, self._segment_filename(expired)))
+                except OSError:
+                    pass
+        self._write_playlist()
+
+    def _write_playlist(self, end=False):
+        lines = [
+            '#EXTM3U',
+            '#EXT-X-VERSION:3',
+            '#EXT-X-TARGETDURATION:%d' % self._target_duration,
+            '#EXT-X-MEDIA-SEQUENCE:%d' % self._first,
+            ]
+        for name, duration in self._completed:
+            lines.append('#EXTINF:%.3f,' % duration)
+            lines.append(name)
+        if end:
+            lines.append('#EXT-X-ENDLIST')
+        lines.append('')
+        _write_atomic(self._playlist, '\n'.join(lines).encode('ascii'))
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def close(self):
+        """
+        Complete the final segment and end the playlist.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            super(PiCameraHLSOutput, self).close()
+            self._control.shutdown(wait=True)
+            if self._file is not None:
+                self._close_segment(self._last_timestamp + self._interval)
+            self._write_playlist(end=True)
+
+
+class PiCameraMP4Output(PiCameraFrameOutput):
+    """
+    An output which writes an H.264 recording to *output* (a filename or a
+    file-like object) as a fragmented MP4 file, using :class:`PiMP4Muxer`.
+
+    Pass the instance as the output of
+    :meth:`~picamera.PiCamera.start_recording` (on the same *splitter_port*)
+    and call :meth:`close` after recording has stopped, which writes the
+    final fragment and closes *output* if it was opened from a filename.
+    The recording must have inline headers at its start (the default).
+    """
+    def __init__(self, camera, output, splitter_port=1):
+        super(PiCameraMP4Output, self).__init__(camera, splitter_port)
+        self._opened = isinstance(output, str)
+        if self._opened:
+            output = io.open(output, 'wb')
+        self._output = output
+        self._muxer = PiMP4Muxer(output)
+
+    @property
+    def output(self):
+        """
+        Returns the file-like object the MP4 file is written to.
+        """
+        return self._output
+
+    def _write_frame(self, header, frame, key_frame, timestamp):
+        if header:
+            frame[:0] = header
+        self._muxer.write_frame(frame, timestamp, key_frame)
+
+    def flush(self):
+        with self._lock:
+            try:
+                self._output.flush()
+            except AttributeError:
+                pass
+
+    def close(self):
+        """
+        Write the final fragment, and close the output if it was opened
+        from a filename.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            super(PiCameraMP4Output, self).close()
+            try:
+                self._muxer.close()
+            finally:
+                if self._opened:
+                    self._output.close()
+
+
+class PiNALScanner(object):
+    """
+    Locates the NAL units of an H.264 Annex-B stream which is passed to
+    :meth:`scan` in pieces of any size, e.g. as buffers from an encoder.
+
+    Start codes which straddle two pieces are found, so the pieces need not
+    be aligned to NAL units.
+    """
+    START_CODE = b'\x00\x00\x01'
+
+    def __init__(self):
+        self._offset = 0
+        # The last two bytes of the stream so far, and the offset of a start
+        # code whose NAL header hasn't been seen yet
+        self._tail = b''
+        self._pending = None
+
+    @property
+    def offset(self):
+        """
+        Returns the number of bytes scanned so far.
+        """
+        return self._offset
+
+    def scan(self, data):
+        """
+        Scan the next piece of the stream, *data*, returning a list of
+        ``(offset, nal_type)`` tuples for each NAL unit whose header it
+        contains. Offsets are those of the units' (3-byte) start codes from
+        the beginning of the stream.
+        """
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        base = self._offset
+        result = []
+        if self._pending is not None and data:
+            result.append((self._pending, _nal_type(data)))
+            self._pending = None
+        if self._tail:
+            joint = self._tail + bytes(data[:2])
+            pos = joint.find(self.START_CODE)
+            if -1 < pos < len(self._tail):
+                header = pos + 3 - len(self._tail)
+                self._found(
+                    result, data, base - len(self._tail) + pos, header)
+        pos = data.find(self.START_CODE)
+        while pos != -1:
+            self._found(result, data, base + pos, pos + 3)
+            pos = data.find(self.START_CODE, pos + 3)
+        self._tail = (self._tail + bytes(data[-2:]))[-2:]
+        self._offset += len(data)
+        return result
+
+    def _found(self, result, data, offset, header):
+        if header < len(data):
+            result.append((offset, _nal_type(data[header:header + 1])))
+        else:
+            self._pending = offset
+
+
+# The sidecar index is a header followed by one fixed-size record per NAL
+# unit: frame index, byte offset, timestamp (-1 if unknown), NAL type, flags
+_INDEX_MAGIC = b'PIDX\x01'
+_INDEX_RECORD = struct.Struct(native_str('<IQqBB'))
+_INDEX_KEY_FRAME = 1
+
+
+class PiCameraIndexedOutput(object):
+    """
+    An output which writes an H.264 recording to *output* unchanged, while
+    recording the position of each NAL unit in a sidecar index which can be
+    read by :class:`PiH264Index`.
+
+    The index is written to *index* (a filename or file-like object), which
+    defaults to *output* with ``.idx`` appended if *output* is a filename.
+    Each record holds the index of the encoder's frame, the byte offset of
+    the NAL unit, the frame's timestamp, the NAL unit type, and whether the
+    frame is a key frame or SPS header. Pass the instance as the output of
+    :meth:`~picamera.PiCamera.start_recording` (on the same *splitter_port*)
+    and call :meth:`close` after recording has stopped.
+    """
+    def __init__(self, camera, output, index=None, splitter_port=1):
+        try:
+            camera._encoders
+        except AttributeError:
+            raise PiCameraValueError('camera must be a valid PiCamera object')
+        if index is None:
+            if not isinstance(output, str):
+                raise PiCameraValueError(
+                    'index must be specified when output is not a filename')
+            index = output + '.idx'
+        self.camera = camera
+        self.splitter_port = splitter_port
+        self._lock = RLock()
+        self._closed = False
+        self._scanner = PiNALScanner()
+        self._opened = isinstance(output, str)
+        self._output = io.open(output, 'wb') if self._opened else output
+        try:
+            self._index_opened = isinstance(index, str)
+            self._index = io.open(index, 'wb') if self._index_opened else index
+        except:
+            if self._opened:
+                self._output.close()
+            raise
+        self._index.write(_INDEX_MAGIC)
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def write(self, b):
+        """
+        Write *b* to the output, and index the NAL units which begin in it.
+        """
+        with self._lock:
+            if self._closed:
+                raise ValueError('I/O operation on closed output')
+            encoder = self.camera._encoders[self.splitter_port]
+            try:
+                frame = encoder._frame_state
+            except AttributeError:
+                frame = encoder.frame
+            units = self._scanner.scan(b)
+            result = self._output.write(b)
+            if units:
+                timestamp = -1 if frame[5] is None else frame[5]
+                flags = _INDEX_KEY_FRAME if frame[1] in (
+                    PiVideoFrameType.key_frame,
+                    PiVideoFrameType.sps_header) else 0
+                self._index.write(b''.join(
+                    _INDEX_RECORD.pack(
+                        frame[0], offset, timestamp, nal_type, flags)
+                    for offset, nal_type in units))
+            return result
+
+    def flush(self):
+        with self._lock:
+            self._output.flush()
+            self._index.flush()
+
+    def close(self):
+        """
+        Close the output and index if they were opened from filenames, or
+        flush them otherwise.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            for f, opened in (
+                    (self._output, self._opened),
+                    (self._index, self._index_opened)):
+                if opened:
+                    f.close()
+                else:
+                    f.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self.close()
+
+
+class PiH264IndexEntry(namedtuple('PiH264IndexEntry', (
+    'frame',
+    'offset',
+    'timestamp',
+    'nal_type',
+    'key_frame',
+    ))):
+    """
+    A record of the sidecar index read by :class:`PiH264Index`.
+
+    .. attribute:: frame
+
+        The index of the encoder frame the NAL unit belongs to.
+
+    .. attribute:: offset
+
+        The offset of the NAL unit's start code within the recording.
+
+    .. attribute:: timestamp
+
+        The timestamp of the frame in microseconds, or ``None`` if unknown.
+
+    .. attribute:: nal_type
+
+        The NAL unit type (e.g. 5 for an IDR slice, 7 for an SPS).
+
+    .. attribute:: key_frame
+
+        ``True`` if the frame is a key frame or SPS header.
+    """
+
+    __slots__ = () # workaround python issue #24931
+
+
+class PiH264Index(object):
+    """
+    Provides random access to the H.264 recording *filename* by way of the
+    sidecar index written by :class:`PiCameraIndexedOutput`, which is read
+    from *index* (by default *filename* with ``.idx`` appended).
+
+    :meth:`seek` and :meth:`extract` locate frames by timestamp using the
+    index alone; the recording itself is only read to extract content.
+    """
+    def __init__(self, filename, index=None):
+        if index is None:
+            index = filename + '.idx'
+        with io.open(index, 'rb') as f:
+            data = f.read()
+        if not data.startswith(_INDEX_MAGIC):
+            raise PiCameraValueError('%s is not a recording index' % index)
+        self.filename = filename
+        # The records are kept packed and only unpacked on access
+        self._data = data
+        self._count = (len(data) - len(_INDEX_MAGIC)) // _INDEX_RECORD.size
+        # Per-frame tables: the offset of each frame's first NAL unit, and
+        # (for frames containing a picture) the frame's timestamp; plus the
+        # frames at which decoding can start
+        self._offsets = array(_INT64)
+        self._pictures = array(native_str('l'))
+        self._times = array(_INT64)
+        self._starts = array(native_str('l'))
+        idr = array(native_str('l'))
+        last = None
+        for frame, offset, timestamp, nal_type, flags in self._records():
+            if frame != last:
+                last = frame
+                self._offsets.append(offset)
+            number = len(self._offsets) - 1
+            if nal_type in (1, 5) and (
+                    not self._pictures or self._pictures[-1] != number):
+                self._pictures.append(number)
+                self._times.append(
+                    timestamp if timestamp >= 0 else
+                    self._times[-1] if self._times else 0)
+            if nal_type == 7 and (
+                    not self._starts or self._starts[-1] != number):
+                self._starts.append(number)
+            elif nal_type == 5 and (not idr or idr[-1] != number):
+                idr.append(number)
+        if not self._starts:
+            # The recording has no SPS headers after its first frame, or none
+            # at all; start decoding at IDR frames instead
+            self._starts = idr
+
+    def _records(self):
+        size = _INDEX_RECORD.size
+        try:
+            return _INDEX_RECORD.iter_unpack(
+                memoryview(self._data)[
+                    len(_INDEX_MAGIC):len(_INDEX_MAGIC) + self._count * size])
+        except AttributeError:
+            # Py2.7 lacks iter_unpack
+            return (
+                _INDEX_RECORD.unpack_from(
+                    self._data, len(_INDEX_MAGIC) + i * size)
+                for i in range(self._count))
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError('index out of range')
+        frame, offset, timestamp, nal_type, flags = _INDEX_RECORD.unpack_from(
+            self._data, len(_INDEX_MAGIC) + index * _INDEX_RECORD.size)
+        return PiH264IndexEntry(
+            frame, offset, None if timestamp < 0 else timestamp, nal_type,
+            bool(flags & _INDEX_KEY_FRAME))
+
+    def seek(self, timestamp):
+        """
+        Returns a tuple of ``(offset, skip)`` where *offset* is the position
+        in the recording from which decoding must start in order to display
+        the frame presented at *timestamp* (or the last frame before it),
+        and *skip* is the number of frames to decode and discard before that
+        frame is reached.
+        """
+        if not self._pictures:
+            raise PiCameraValueError('The recording contains no frames')
+        i = max(0, bisect_right(self._times, timestamp) - 1)
+        target = self._pictures[i]
+        j = bisect_right(self._starts, target) - 1
+        start = self._starts[j] if j >= 0 else 0
+        skip = i - bisect_right(self._pictures, start - 1)
+        return int(self._offsets[start]), skip
+
+    def extract(self, output, start, end):
+        """
+        Copy the frames presented from *start* to *end* (timestamps in
+        microseconds) to *output* (a filename or file-like object), beginning
+        from the point at which decoding must start (see :meth:`seek`).
+        Returns a tuple of the byte range copied.
+        """
+        first, skip = self.seek(start)
+        i = bisect_right(self._times, end)
+        following = self._pictures[i - 1] + 1 if i else 1
+        opened = isinstance(output, str)
+        if opened:
+            output = io.open(output, 'wb')
+        try:
+            with io.open(self.filename, 'rb') as source:
+                if following < len(self._offsets):
+                    last = int(self._offsets[following])
+                else:
+                    source.seek(0, io.SEEK_END)
+                    last = source.tell()
+                source.seek(first)
+                remaining = last - first
+                while remaining > 0:
+                    data = source.read(min(remaining, 1048576))
+                    if not data:
+                        break
+                    output.write(data)
+                    remaining -= len(data)
+        finally:
+            if opened:
+                output.close()
+        return first, last
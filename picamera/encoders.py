@@ -9,13 +9,24 @@ from __future__ import (
 # Make Py2's str and range equivalent to Py3's
 str = type('')
 
+import os
 import datetime
 import threading
+from time import time
 import warnings
 import ctypes as ct
+from collections import deque
+from concurrent.futures import Future, TimeoutError
+try:
+    import numpy as np
+except ImportError:
+    # numpy is an optional dependency; without it alpha-stripping compacts
+    # a copy of each buffer instead of copying into a reused one
+    np = None
 
 from . import bcm_host, mmal, mmalobj as mo
 from .frames import PiVideoFrame, PiVideoFrameType
+from .streams import _write_chunks
 from .exc import (
     PiCameraMMALError,
     PiCameraValueError,
@@ -27,6 +38,519 @@ from .exc import (
     )
 
 
+class PiEncoderWriter(object):
+    """
+    Wraps *output* in a bounded queue which is drained by a background
+    thread, so that a slow output does not stall the encoder's callback.
+
+    Pass an instance of this class as the output of an encoder (or of
+    :meth:`~picamera.PiCamera.start_recording`). At most *queue_size*
+    buffers are held in the queue; when it is full, *policy* determines
+    what happens to the next buffer:
+
+    * ``'block'`` - wait for the background thread to make room
+
+    * ``'drop-oldest'`` - discard the oldest queued buffers
+
+    * ``'drop-non-keyframes'`` - discard non-key frames (and the rest of
+      their GOP, which cannot be decoded without them), keeping key frames
+      and SPS headers; if the queue holds nothing that can be discarded,
+      wait as with ``'block'``
+
+    The amount of data discarded is reported by :attr:`dropped_bytes` and
+    :attr:`dropped_frames`. Any exception raised by *output* is re-raised
+    by the next call to :meth:`write`.
+
+    Outputs which read the meta-data of the encoder's current frame as they
+    are written to (those with ``camera`` and ``splitter_port`` attributes,
+    such as :class:`~picamera.PiCameraCircularIO`) cannot be wrapped, as the
+    encoder will have moved on to a later frame by the time the background
+    thread writes a buffer; :exc:`~picamera.PiCameraValueError` is raised
+    for them.
+    """
+
+    POLICIES = ('block', 'drop-oldest', 'drop-non-keyframes')
+
+    def __init__(self, output, queue_size=64, policy='block'):
+        if policy not in self.POLICIES:
+            raise PiCameraValueError('Invalid writer policy %s' % policy)
+        if queue_size < 1:
+            raise PiCameraValueError('queue_size must be at least 1')
+        if hasattr(output, 'splitter_port') and hasattr(
+                getattr(output, 'camera', None), '_encoders'):
+            raise PiCameraValueError(
+                'Outputs which read the encoder\'s frame meta-data cannot be '
+                'written from a background thread')
+        self._output, self._opened = mo.open_stream(output)
+        self._queue_size = queue_size
+        self._policy = policy
+        # Queued buffers are [data, frame_type, complete, live] lists; the
+        # buffers which the policy may discard are also tracked in _motion
+        # and _frames so that they can be found without searching the queue.
+        # Discarded (or written) buffers are marked not live, and removed
+        # from the deques lazily; _queued counts the live buffers
+        self._queue = deque()
+        self._motion = deque()
+        self._frames = deque()
+        self._last = None
+        self._queued = 0
+        self._lock = threading.Lock()
+        # Signalled whenever the queue or the writing state changes
+        self._changed = threading.Condition(self._lock)
+        self._writing = False
+        self._skipping = False
+        self._closed = False
+        self._exception = None
+        self._reported = False
+        self._dropped_bytes = 0
+        self._dropped_frames = 0
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self.close()
+
+    @property
+    def output(self):
+        """
+        Returns the output that queued buffers are written to.
+        """
+        return self._output
+
+    @property
+    def policy(self):
+        """
+        Returns the overflow policy the writer was constructed with.
+        """
+        return self._policy
+
+    @property
+    def queue_size(self):
+        """
+        Returns the maximum number of buffers held in the queue.
+        """
+        return self._queue_size
+
+    @property
+    def dropped_bytes(self):
+        """
+        Returns the number of bytes discarded by the overflow policy.
+        """
+        return self._dropped_bytes
+
+    @property
+    def dropped_frames(self):
+        """
+        Returns the number of frames (whole or in part) discarded by the
+        overflow policy.
+        """
+        return self._dropped_frames
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def write(self, b, frame_type=None, complete=True):
+        """
+        Queue *b* to be written to the output, returning its length (whether
+        or not it was discarded by the overflow policy).
+
+        Encoders pass the :class:`~picamera.PiVideoFrameType` of each buffer
+        as *frame_type* and whether it ends a frame as *complete*. Buffers
+        with a *frame_type* of ``None`` are never discarded by the
+        ``'drop-non-keyframes'`` policy.
+        """
+        # Copy the data; callers (e.g. PiEncoderFrameWriter) may reuse it
+        b = bytes(b)
+        size = len(b)
+        with self._lock:
+            self._check()
+            if self._skipping:
+                if frame_type == PiVideoFrameType.frame:
+                    self._drop(size, complete)
+                    return size
+                if frame_type in (
+                        PiVideoFrameType.key_frame,
+                        PiVideoFrameType.sps_header):
+                    self._skipping = False
+            while self._queued >= self._queue_size:
+                if self._policy == 'drop-oldest':
+                    self._discard(self._pop())
+                elif (
+                        self._policy == 'drop-non-keyframes' and
+                        self._drop_queued(frame_type)):
+                    pass
+                elif (
+                        self._policy == 'drop-non-keyframes' and
+                        frame_type in (
+                            PiVideoFrameType.frame,
+                            PiVideoFrameType.motion_data)):
+                    if frame_type == PiVideoFrameType.frame:
+                        # Discard the queued part of this frame, and the
+                        # rest of its GOP which can't be decoded without it
+                        last = self._last
+                        if (
+                                last is not None and last[3] and
+                                last[1] == frame_type and not last[2]):
+                            self._discard_frame()
+                        self._skipping = True
+                    self._drop(size, complete)
+                    return size
+                else:
+                    self._changed.wait()
+                    self._check()
+            item = [b, frame_type, complete, True]
+            self._queue.append(item)
+            self._queued += 1
+            self._last = item
+            if frame_type == PiVideoFrameType.motion_data:
+                self._track(self._motion, item)
+            elif frame_type == PiVideoFrameType.frame:
+                self._track(self._frames, item)
+            self._changed.notify_all()
+        return size
+
+    @staticmethod
+    def _track(items, item):
+        # Drop entries which are no longer live from the front of *items*,
+        # so it doesn't grow with buffers that have already been written
+        while items and not items[0][3]:
+            items.popleft()
+        items.append(item)
+
+    def flush(self):
+        """
+        Wait for all queued buffers to be written, then flush the output.
+        """
+        with self._lock:
+            while (self._queued or self._writing) and self._exception is None:
+                self._changed.wait()
+            if not self._reported:
+                self._check()
+        if self._exception is None:
+            try:
+                self._output.flush()
+            except AttributeError:
+                pass
+
+    def close(self):
+        """
+        Write all queued buffers, stop the background thread, and close the
+        output if it was opened by the writer.
+        """
+        if not self._closed:
+            try:
+                self.flush()
+            finally:
+                with self._lock:
+                    self._closed = True
+                    self._changed.notify_all()
+                self._thread.join()
+                mo.close_stream(self._output, self._opened)
+
+    def _check(self):
+        if self._exception is not None:
+            self._reported = True
+            raise self._exception
+        if self._closed:
+            raise PiCameraValueError('I/O operation on closed writer')
+
+    def _drop(self, size, complete):
+        self._dropped_bytes += size
+        if complete:
+            self._dropped_frames += 1
+
+    def _discard(self, item):
+        item[3] = False
+        self._queued -= 1
+        self._drop(len(item[0]), item[2])
+        item[0] = None
+
+    def _pop(self):
+        # Remove and return the oldest live buffer in the queue
+        while True:
+            item = self._queue.popleft()
+            if item[3]:
+                return item
+
+    def _discard_frame(self):
+        # Discard the parts of the last queued non-key frame. Returns True if
+        # there was one
+        frames = self._frames
+        while frames and not frames[-1][3]:
+            frames.pop()
+        if not frames:
+            return False
+        self._discard(frames.pop())
+        while frames and frames[-1][3] and not frames[-1][2]:
+            self._discard(frames.pop())
+        return True
+
+    def _drop_queued(self, frame_type):
+        # Make room for a buffer of *frame_type* by discarding queued motion
+        # data or, if the buffer is a key frame or header, the last queued
+        # non-key frame (which leaves its GOP decodable, just shorter).
+        # Returns True if anything was discarded
+        dropped = False
+        while self._motion:
+            item = self._motion.popleft()
+            if item[3]:
+                self._discard(item)
+                dropped = True
+        if dropped:
+            return True
+        if frame_type not in (
+                PiVideoFrameType.key_frame, PiVideoFrameType.sps_header):
+            return False
+        return self._discard_frame()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._queued and not self._closed:
+                    self._changed.wait()
+                if not self._queued:
+                    break
+                item = self._pop()
+                item[3] = False
+                self._queued -= 1
+                data = item[0]
+                self._writing = True
+                self._changed.notify_all()
+            try:
+                written = self._output.write(data)
+                # Ignore None return value; most Python 2 streams have no
+                # return value for write()
+                if (written is not None) and (written != len(data)):
+                    raise PiCameraIOError(
+                        "Failed to write %d bytes from buffer to "
+                        "output %r" % (len(data), self._output))
+            except Exception as e:
+                with self._lock:
+                    self._exception = e
+                    for item in self._queue:
+                        item[3] = False
+                    self._queue.clear()
+                    self._motion.clear()
+                    self._frames.clear()
+                    self._queued = 0
+                    self._writing = False
+                    self._changed.notify_all()
+                break
+            with self._lock:
+                self._writing = False
+                self._changed.notify_all()
+
+
+class PiEncoderTee(object):
+    """
+    Writes the same data to each of *outputs*, isolating their failures.
+
+    Each output may be a filename, a file-like object, or a
+    :class:`PiEncoderWriter` (so that a slow output does not hold up the
+    others). If an output raises an exception it is closed, removed from
+    :attr:`outputs`, and the exception is recorded in :attr:`errors`; the
+    exception is only re-raised when no outputs remain.
+    """
+
+    def __init__(self, outputs):
+        self._outputs = []
+        self._errors = []
+        try:
+            for output in outputs:
+                self._outputs.append(mo.open_stream(output))
+        except:
+            self.close()
+            raise
+        if not self._outputs:
+            raise PiCameraValueError('At least one output must be given')
+
+    @property
+    def outputs(self):
+        """
+        Returns a list of the outputs which are still being written to.
+        """
+        return [output for output, opened in self._outputs]
+
+    @property
+    def errors(self):
+        """
+        Returns a list of ``(output, exception)`` tuples for each output
+        which has been removed due to an error.
+        """
+        return list(self._errors)
+
+    def write(self, b, frame_type=None, complete=True):
+        """
+        Write *b* to every output. *frame_type* and *complete* are passed on
+        to outputs which are instances of :class:`PiEncoderWriter` or
+        :class:`PiEncoderFrameWriter`.
+        """
+        failed = []
+        for index, (output, opened) in enumerate(self._outputs):
+            try:
+                if isinstance(output, _FRAME_OUTPUTS):
+                    written = output.write(b, frame_type, complete)
+                else:
+                    written = output.write(b)
+                # Ignore None return value; most Python 2 streams have no
+                # return value for write()
+                if (written is not None) and (written != len(b)):
+                    raise PiCameraIOError(
+                        "Failed to write %d bytes from buffer to "
+                        "output %r" % (len(b), output))
+            except Exception as e:
+                failed.append((index, e))
+        for index, e in reversed(failed):
+            output, opened = self._outputs.pop(index)
+            self._errors.append((output, e))
+            try:
+                mo.close_stream(output, opened)
+            except Exception:
+                pass
+        if failed and not self._outputs:
+            raise failed[-1][1]
+        return len(b)
+
+    def flush(self):
+        for output, opened in self._outputs:
+            try:
+                output.flush()
+            except AttributeError:
+                pass
+
+    def close(self):
+        """
+        Close the outputs that were opened by the tee, and flush the rest.
+        """
+        outputs, self._outputs = self._outputs, []
+        for output, opened in outputs:
+            mo.close_stream(output, opened)
+
+
+class PiEncoderFrameWriter(object):
+    """
+    Wraps *output* so that it receives one write per complete frame, rather
+    than one per encoder buffer.
+
+    Frames which span several buffers are assembled in a buffer which is
+    reused from frame to frame, and each is passed to *output* as a new
+    :class:`bytes` object which it may keep. If *output* has a file
+    descriptor the parts
+    of each frame are instead written with a single vectored write (where
+    the platform supports it), avoiding the copy. Because each frame is
+    written from within the encoder's callback for its final buffer, the
+    encoder's :attr:`~PiVideoEncoder.frame` describes the complete frame at
+    the time it is written.
+    """
+
+    def __init__(self, output):
+        self._output, self._opened = mo.open_stream(output)
+        try:
+            self._vectored = (
+                hasattr(os, 'writev') and self._output.fileno() is not None)
+        except (AttributeError, IOError, OSError):
+            self._vectored = False
+        self._buf = bytearray()
+        self._used = 0
+        self._parts = []
+        self._frame_type = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self.close()
+
+    @property
+    def output(self):
+        """
+        Returns the output that frames are written to.
+        """
+        return self._output
+
+    def write(self, b, frame_type=None, complete=True):
+        """
+        Add *b* to the current frame, writing the frame to the output if
+        *complete* is ``True``. Returns the length of *b*.
+        """
+        size = len(b)
+        if complete and not (self._used or self._parts):
+            self._write((b,), frame_type)
+        else:
+            if self._vectored:
+                # The encoder's buffer may be reused once this returns, so
+                # anything other than an immutable bytes object is copied
+                self._parts.append(b if isinstance(b, bytes) else bytes(b))
+            else:
+                self._buf[self._used:self._used + size] = b
+                self._used += size
+            if complete:
+                self._write_frame(frame_type)
+        return size
+
+    def flush(self):
+        """
+        Write any incomplete frame, then flush the output.
+        """
+        if self._used or self._parts:
+            self._write_frame(None)
+        try:
+            self._output.flush()
+        except AttributeError:
+            pass
+
+    def close(self):
+        """
+        Write any incomplete frame, and close the output if it was opened by
+        the writer.
+        """
+        if self._output is not None:
+            try:
+                if self._used or self._parts:
+                    self._write_frame(None)
+            finally:
+                output, self._output = self._output, None
+                mo.close_stream(output, self._opened)
+
+    def _write_frame(self, frame_type):
+        if self._vectored:
+            parts, self._parts = self._parts, []
+        else:
+            # The output gets its own copy; a view of the reused buffer would
+            # be overwritten by the next frame (or block its resizing) if the
+            # output kept it
+            parts = (memoryview(self._buf)[:self._used].tobytes(),)
+            self._used = 0
+        self._write(parts, frame_type)
+
+    def _write(self, parts, frame_type):
+        output = self._output
+        if len(parts) > 1:
+            _write_chunks(output, parts)
+            return
+        data = parts[0]
+        if isinstance(output, _FRAME_OUTPUTS):
+            written = output.write(data, frame_type, True)
+        else:
+            written = output.write(data)
+        # Ignore None return value; most Python 2 streams have no return
+        # value for write()
+        if (written is not None) and (written != len(data)):
+            raise PiCameraIOError(
+                "Failed to write %d bytes from buffer to output %r" % (
+                    len(data), output))
+
+
+# Outputs which accept the frame type and completeness of each buffer as
+# additional arguments to write()
+_FRAME_OUTPUTS = (PiEncoderWriter, PiEncoderTee, PiEncoderFrameWriter)
+
+
 class PiEncoder(object):
     """
 
@@ -47,6 +571,7 @@ class PiEncoder(object):
         self.outputs = {}
         self.exception = None
         self.event = threading.Event()
+        self._waiters = []
         try:
             if parent and parent.closed:
                 raise PiCameraRuntimeError("Camera is closed")
@@ -99,6 +624,7 @@ class PiEncoder(object):
             self.exception = e
         if stop:
             self.event.set()
+            self._resolve_waiters()
         return stop
 
     def _callback_write(self, buf, key=PiVideoFrameType.frame):
@@ -109,7 +635,11 @@ class PiEncoder(object):
             with self.outputs_lock:
                 try:
                     output = self.outputs[key][0]
-                    written = output.write(buf.data)
+                    if isinstance(output, _FRAME_OUTPUTS):
+                        written = output.write(
+                            buf.data, *self._buffer_info(buf, key))
+                    else:
+                        written = output.write(buf.data)
                 except KeyError:
 
                     pass
@@ -122,6 +652,14 @@ class PiEncoder(object):
                             "output %r" % (buf.length, output))
         return bool(buf.flags & mmal.MMAL_BUFFER_HEADER_FLAG_EOS)
 
+    def _buffer_info(self, buf, key):
+        """
+        Returns the frame type of *buf* and whether it completes a frame, for
+        the benefit of :class:`PiEncoderWriter`. The base implementation
+        returns ``None`` as the type so the writer never discards buffers.
+        """
+        return None, bool(buf.flags & mmal.MMAL_BUFFER_HEADER_FLAG_FRAME_END)
+
     def _open_output(self, output, key=PiVideoFrameType.frame):
         """
 
@@ -166,6 +704,49 @@ class PiEncoder(object):
                 mo.print_pipeline(self.output_port)
             self.parent._start_capture(self.camera_port)
 
+    def _reset(self):
+        """
+        Clears the state left over from the encoder's last use so that it can
+        be started again, e.g. by :class:`PiEncoderPool`.
+        """
+        self._resolve_waiters()
+        self.event.clear()
+        self.exception = None
+
+    def _resolve_waiters(self):
+        with self.outputs_lock:
+            waiters, self._waiters = self._waiters, []
+        for future in waiters:
+            self._resolve_waiter(future)
+
+    def _resolve_waiter(self, future):
+        if future.set_running_or_notify_cancel():
+            if self.exception:
+                future.set_exception(self.exception)
+            else:
+                future.set_result(None)
+
+    def wait_async(self):
+        """
+        Returns a :class:`~concurrent.futures.Future` which completes when
+        the encoder finishes, i.e. when its output ends or fails, or
+        :meth:`stop` is called. If the encoder failed, the future holds the
+        exception which :meth:`wait` would raise.
+
+        Unlike :meth:`wait` this does not stop the encoder, so a controller
+        can wait on many encoders (e.g. with
+        :func:`concurrent.futures.wait`) from one thread and call
+        :meth:`stop` on those which finish.
+        """
+        future = Future()
+        with self.outputs_lock:
+            finished = self.event.is_set()
+            if not finished:
+                self._waiters.append(future)
+        if finished:
+            self._resolve_waiter(future)
+        return future
+
     def wait(self, timeout=None):
         """
 
@@ -186,6 +767,7 @@ class PiEncoder(object):
                     self.parent._stop_capture(self.camera_port)
             self.output_port.disable()
         self.event.set()
+        self._resolve_waiters()
         self._close_output()
 
     def close(self):
@@ -206,13 +788,29 @@ class PiEncoder(object):
 
 class MMALBufferAlphaStrip(mo.MMALBuffer):
     """
+    Presents the content of an RGBA or BGRA buffer with the alpha bytes
+    removed.
 
+    Each buffer's :attr:`data` is a new :class:`bytearray`, which outputs
+    may keep. If numpy is available the colour channels are copied into it
+    directly, rather than compacting a copy of the whole buffer.
     """
 
     def __init__(self, buf):
         super(MMALBufferAlphaStrip, self).__init__(buf)
-        self._stripped = bytearray(super(MMALBufferAlphaStrip, self).data)
-        del self._stripped[3::4]
+        data = super(MMALBufferAlphaStrip, self).data
+        if np is None:
+            self._stripped = bytearray(data)
+            del self._stripped[3::4]
+            return
+        pixels = len(data) // 4
+        self._stripped = bytearray(pixels * 3)
+        # One strided copy per channel is considerably quicker than copying
+        # (pixels, 4) rows into (pixels, 3) rows
+        src = np.frombuffer(data, dtype=np.uint8, count=pixels * 4)
+        dest = np.frombuffer(self._stripped, dtype=np.uint8)
+        for channel in range(3):
+            dest[channel::3] = src[channel::4]
 
     @property
     def length(self):
@@ -309,7 +907,8 @@ class PiRawMixin(PiEncoder):
 
         """
         if self._strip_alpha:
-            return super(PiRawMixin, self)._callback_write(MMALBufferAlphaStrip(buf._buf), key)
+            buf = MMALBufferAlphaStrip(buf._buf)
+            return super(PiRawMixin, self)._callback_write(buf, key)
         else:
             return super(PiRawMixin, self)._callback_write(buf, key)
 
@@ -327,7 +926,11 @@ class PiVideoEncoder(PiEncoder):
                 parent, camera_port, input_port, format, resize, **options)
         self._next_output = []
         self._split_frame = None
-        self.frame = None
+        # The meta-data of the current frame is held as a list with the same
+        # fields as PiVideoFrame; the (immutable) PiVideoFrame tuple is only
+        # constructed when the frame attribute is read
+        self._frame_state = None
+        self._frame_cache = None
 
     def _create_encoder(
             self, format, bitrate=17000000, intra_period=None, profile='high',
@@ -521,9 +1124,31 @@ class PiVideoEncoder(PiEncoder):
         self.encoder.inputs[0].params[mmal.MMAL_PARAMETER_VIDEO_IMMUTABLE_INPUT] = True
         self.encoder.enable()
 
+    @property
+    def frame(self):
+        """
+        Returns a :class:`~picamera.PiVideoFrame` describing the frame most
+        recently written by the encoder, or ``None`` if the encoder has not
+        been started.
+        """
+        state = self._frame_state
+        if state is None:
+            return None
+        cache = self._frame_cache
+        if cache is None or cache[0] is not state:
+            cache = (state, PiVideoFrame(*state))
+            self._frame_cache = cache
+        return cache[1]
+
+    @frame.setter
+    def frame(self, value):
+        self._frame_state = None if value is None else list(value)
+
     def start(self, output, motion_output=None):
         """
-        Extended to initialize video frame meta-data tracking.
+        Extended to initialize video frame meta-data tracking. Either
+        output may be a list, tuple or set of outputs which will all receive
+        the same data (this also applies to :meth:`split`).
         """
         self.frame = PiVideoFrame(
                 index=0,
@@ -539,8 +1164,41 @@ class PiVideoEncoder(PiEncoder):
         super(PiVideoEncoder, self).start(output)
 
     def stop(self):
+        """
+        Extended to close the motion output, and to fail any splits which
+        are still pending.
+        """
         super(PiVideoEncoder, self).stop()
         self._close_output(PiVideoFrameType.motion_data)
+        self._fail_splits('Encoder stopped before a split point was reached')
+
+    def _fail_splits(self, message):
+        # Fails all pending split requests with PiCameraRuntimeError
+        with self.outputs_lock:
+            pending, self._next_output = self._next_output, []
+        for outputs, future, deadline in pending:
+            if future.set_running_or_notify_cancel():
+                future.set_exception(PiCameraRuntimeError(message))
+
+    def _reset(self):
+        """
+        Extended to clear frame meta-data and pending splits.
+        """
+        super(PiVideoEncoder, self)._reset()
+        self._fail_splits('Encoder reset before a split point was reached')
+        self._split_frame = None
+        self.frame = None
+
+    def _open_output(self, output, key=PiVideoFrameType.frame):
+        """
+        Extended to accept a list, tuple or set of outputs which will all be
+        written to via a :class:`PiEncoderTee`.
+        """
+        if isinstance(output, (list, tuple, set, frozenset)):
+            with self.outputs_lock:
+                self.outputs[key] = (PiEncoderTee(output), True)
+        else:
+            super(PiVideoEncoder, self)._open_output(output, key)
 
     def request_key_frame(self):
         """
@@ -554,90 +1212,148 @@ class PiVideoEncoder(PiEncoder):
 
      .
         """
+        timeout = self._split_timeout()
+        future = self.split_async(output, motion_output, timeout)
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            if future.cancel():
+                raise PiCameraRuntimeError(
+                    'Timed out waiting for a split point')
+            return future.result()
+
+    def split_async(self, output, motion_output=None, timeout=None):
+        """
+        Requests that the encoder's output be switched at the next split
+        point (an SPS header), without waiting for it.
+
+        Returns a :class:`~concurrent.futures.Future` which holds the
+        :class:`~picamera.PiVideoFrame` of the split point once the switch
+        has happened. Requests are served in order, one per split point.
+        A request may be withdrawn by cancelling its future before the switch
+        happens. If *timeout* (in seconds) is given and elapses before the
+        switch, the request is withdrawn and the future fails with
+        :exc:`~picamera.PiCameraRuntimeError`, as it does if the encoder is
+        stopped first.
+        """
+        outputs = {}
+        if output is not None:
+            outputs[PiVideoFrameType.frame] = output
+        if motion_output is not None:
+            outputs[PiVideoFrameType.motion_data] = motion_output
+        future = Future()
+        deadline = None if timeout is None else time() + timeout
         with self.outputs_lock:
-            outputs = {}
-            if output is not None:
-                outputs[PiVideoFrameType.frame] = output
-            if motion_output is not None:
-                outputs[PiVideoFrameType.motion_data] = motion_output
-            self._next_output.append(outputs)
+            self._next_output.append((outputs, future, deadline))
+        if self._intra_period > 1:
+            self.request_key_frame()
+        return future
 
+    def _split_timeout(self):
+        # A split point should arrive within a few intra-periods of a key
+        # frame being requested
         if self.parent:
             framerate = self.parent.framerate + self.parent.framerate_delta
         else:
             framerate = self.input_port.framerate
-        timeout = max(15.0, float(self._intra_period / framerate) * 3.0)
-        if self._intra_period > 1:
-            self.request_key_frame()
-        if not self.event.wait(timeout):
-            raise PiCameraRuntimeError('Timed out waiting for a split point')
-        self.event.clear()
-        return self._split_frame
+        return max(15.0, float(self._intra_period / framerate) * 3.0)
+
+    def _next_split(self):
+        # Returns the outputs and future of the first pending split request
+        # which hasn't been cancelled or timed out, or (None, None)
+        now = time()
+        with self.outputs_lock:
+            while self._next_output:
+                outputs, future, deadline = self._next_output.pop(0)
+                if deadline is not None and now > deadline:
+                    if future.set_running_or_notify_cancel():
+                        future.set_exception(PiCameraRuntimeError(
+                            'Timed out waiting for a split point'))
+                elif future.set_running_or_notify_cancel():
+                    return outputs, future
+        return None, None
+
+    def _expire_splits(self):
+        # Fails pending split requests whose timeouts have elapsed, so their
+        # futures complete even while no split point arrives
+        now = time()
+        with self.outputs_lock:
+            expired = [
+                request for request in self._next_output
+                if request[2] is not None and now > request[2]
+                ]
+            for request in expired:
+                self._next_output.remove(request)
+        for outputs, future, deadline in expired:
+            if future.set_running_or_notify_cancel():
+                future.set_exception(PiCameraRuntimeError(
+                    'Timed out waiting for a split point'))
+
+    def _buffer_info(self, buf, key):
+        """
+        Overridden to return the type of the frame being written. When every
+        frame is intra-coded (as in MJPEG), each is treated as a key frame.
+        """
+        state = self._frame_state
+        frame_type = state[1]
+        if self._intra_period == 1 and frame_type == PiVideoFrameType.frame:
+            frame_type = PiVideoFrameType.key_frame
+        return frame_type, state[6]
 
     def _callback_write(self, buf, key=PiVideoFrameType.frame):
         """
 
         """
-        last_frame = self.frame
-        this_frame = PiVideoFrame(
-            index=
-                last_frame.index + 1
-                if last_frame.complete else
-                last_frame.index,
-            frame_type=
-                PiVideoFrameType.key_frame
-                if buf.flags & mmal.MMAL_BUFFER_HEADER_FLAG_KEYFRAME else
-                PiVideoFrameType.sps_header
-                if buf.flags & mmal.MMAL_BUFFER_HEADER_FLAG_CONFIG else
-                PiVideoFrameType.motion_data
-                if buf.flags & mmal.MMAL_BUFFER_HEADER_FLAG_CODECSIDEINFO else
-                PiVideoFrameType.frame,
-            frame_size=
-                buf.length
-                if last_frame.complete else
-                last_frame.frame_size + buf.length,
-            video_size=
-                last_frame.video_size
-                if buf.flags & mmal.MMAL_BUFFER_HEADER_FLAG_CODECSIDEINFO else
-                last_frame.video_size + buf.length,
-            split_size=
-                last_frame.split_size
-                if buf.flags & mmal.MMAL_BUFFER_HEADER_FLAG_CODECSIDEINFO else
-                last_frame.split_size + buf.length,
-            timestamp=
-                # Time cannot go backwards, so if we've got an unknown pts
-                # simply repeat the last one
-                last_frame.timestamp
-                if buf.pts in (0, mmal.MMAL_TIME_UNKNOWN) else
-                buf.pts,
-            complete=
-                bool(buf.flags & mmal.MMAL_BUFFER_HEADER_FLAG_FRAME_END)
-            )
-        if self._intra_period == 1 or (buf.flags & mmal.MMAL_BUFFER_HEADER_FLAG_CONFIG):
-            with self.outputs_lock:
-                try:
-                    new_outputs = self._next_output.pop(0)
-                except IndexError:
-                    new_outputs = None
-            if new_outputs:
-                for new_key, new_output in new_outputs.items():
-                    self._close_output(new_key)
-                    self._open_output(new_output, new_key)
-                    if new_key == PiVideoFrameType.frame:
-                        this_frame = PiVideoFrame(
-                                index=this_frame.index,
-                                frame_type=this_frame.frame_type,
-                                frame_size=this_frame.frame_size,
-                                video_size=this_frame.video_size,
-                                split_size=0,
-                                timestamp=this_frame.timestamp,
-                                complete=this_frame.complete,
-                                )
-                self._split_frame = this_frame
-                self.event.set()
-        if buf.flags & mmal.MMAL_BUFFER_HEADER_FLAG_CODECSIDEINFO:
+        (
+            last_index, _, last_frame_size, last_video_size, last_split_size,
+            last_timestamp, last_complete
+            ) = self._frame_state
+        flags = buf.flags
+        side_info = flags & mmal.MMAL_BUFFER_HEADER_FLAG_CODECSIDEINFO
+        this_frame = [
+            # index
+            last_index + 1 if last_complete else last_index,
+            # frame_type
+            PiVideoFrameType.key_frame
+            if flags & mmal.MMAL_BUFFER_HEADER_FLAG_KEYFRAME else
+            PiVideoFrameType.sps_header
+            if flags & mmal.MMAL_BUFFER_HEADER_FLAG_CONFIG else
+            PiVideoFrameType.motion_data
+            if side_info else
+            PiVideoFrameType.frame,
+            # frame_size
+            buf.length if last_complete else last_frame_size + buf.length,
+            # video_size
+            last_video_size if side_info else last_video_size + buf.length,
+            # split_size
+            last_split_size if side_info else last_split_size + buf.length,
+            # timestamp; time cannot go backwards, so if we've got an unknown
+            # pts simply repeat the last one
+            last_timestamp if buf.pts in (0, mmal.MMAL_TIME_UNKNOWN) else
+            buf.pts,
+            # complete
+            bool(flags & mmal.MMAL_BUFFER_HEADER_FLAG_FRAME_END),
+            ]
+        if self._next_output:
+            if self._intra_period == 1 or (flags & mmal.MMAL_BUFFER_HEADER_FLAG_CONFIG):
+                new_outputs, future = self._next_split()
+                if future is not None:
+                    try:
+                        for new_key, new_output in new_outputs.items():
+                            self._close_output(new_key)
+                            self._open_output(new_output, new_key)
+                            if new_key == PiVideoFrameType.frame:
+                                this_frame[4] = 0  # split_size
+                    except Exception as e:
+                        future.set_exception(e)
+                        raise
+                    self._split_frame = PiVideoFrame(*this_frame)
+                    future.set_result(self._split_frame)
+            else:
+                self._expire_splits()
+        if side_info:
             key = PiVideoFrameType.motion_data
-        self.frame = this_frame
+        self._frame_state = this_frame
         return super(PiVideoEncoder, self)._callback_write(buf, key)
 
 
@@ -861,3 +1577,157 @@ class PiRawMultiImageEncoder(PiMultiImageEncoder, PiRawImageMixin):
         super(PiRawMultiImageEncoder, self)._next_output(key)
         self._image_size = self._frame_size
 
+
+def _freeze(value):
+    # Convert *value* to something hashable for use in a PiEncoderPool key
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+class PiEncoderPool(object):
+    """
+    Keeps encoders which have finished recording or capturing connected, so
+    that they can be started again without rebuilding their MMAL components.
+
+    :meth:`acquire` returns an idle encoder of the requested class which was
+    constructed with the same ports, format, resize and options, or
+    constructs a new one if there isn't one. :meth:`release` stops an
+    encoder and returns it to the pool, keeping at most *max_idle* idle
+    encoders of each kind; surplus encoders are closed. Idle encoders remain
+    connected, but their connections and output ports are disabled so that
+    they do not process frames while idle.
+
+    Because the encoders' formats are derived from their input ports,
+    :meth:`clear` must be called when the configuration of those ports
+    changes (e.g. when the camera's resolution or framerate is changed).
+    Raw encoders, which configure their input port directly, are never kept.
+    """
+
+    def __init__(self, max_idle=1):
+        if max_idle < 0:
+            raise PiCameraValueError('max_idle must be zero or more')
+        self._max_idle = max_idle
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._keys = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self.close()
+
+    @property
+    def max_idle(self):
+        """
+        Returns the maximum number of idle encoders kept for each kind.
+        """
+        return self._max_idle
+
+    def acquire(
+            self, encoder_class, parent, camera_port, input_port, format,
+            resize, **options):
+        """
+        Return an encoder of *encoder_class* constructed with the specified
+        parameters, ready for :meth:`~PiEncoder.start` to be called.
+        """
+        key = None
+        if not issubclass(encoder_class, PiRawMixin):
+            try:
+                key = (
+                    encoder_class, id(parent), id(camera_port),
+                    id(input_port), format, _freeze(resize),
+                    _freeze(options))
+                hash(key)
+            except TypeError:
+                key = None
+        encoder = None
+        with self._lock:
+            if key is not None:
+                try:
+                    encoder = self._idle[key].pop()
+                except (KeyError, IndexError):
+                    pass
+        if encoder is None:
+            encoder = encoder_class(
+                parent, camera_port, input_port, format, resize, **options)
+        else:
+            try:
+                self._enable(encoder, True)
+            except:
+                encoder.close()
+                raise
+            encoder._reset()
+        with self._lock:
+            self._keys[id(encoder)] = key
+        return encoder
+
+    def release(self, encoder):
+        """
+        Stop *encoder* and return it to the pool, or close it if the pool
+        already holds enough idle encoders of its kind.
+        """
+        with self._lock:
+            key = self._keys.pop(id(encoder), None)
+        try:
+            encoder.stop()
+        except:
+            encoder.close()
+            raise
+        if (
+                key is not None and
+                encoder.output_port is not None and
+                not (encoder.parent and encoder.parent.closed)):
+            encoder._reset()
+            with self._lock:
+                idle = self._idle.setdefault(key, [])
+                keep = len(idle) < self._max_idle
+            if keep:
+                try:
+                    self._enable(encoder, False)
+                except:
+                    encoder.close()
+                    raise
+                with self._lock:
+                    idle.append(encoder)
+                return
+        encoder.close()
+
+    @staticmethod
+    def _enable(encoder, enabled):
+        # Enable or disable the connections feeding *encoder*, in the order
+        # the encoder enables them when constructed (and the reverse)
+        connections = [
+            component.connection
+            for component in (encoder.encoder, encoder.resizer)
+            if component
+            ]
+        if not enabled:
+            connections.reverse()
+        for connection in connections:
+            if enabled:
+                connection.enable()
+            else:
+                connection.disable()
+
+    def clear(self):
+        """
+        Close all idle encoders.
+        """
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for encoders in idle.values():
+            for encoder in encoders:
+                encoder.close()
+
+    def close(self):
+        """
+        Close all idle encoders. Encoders which have been acquired but not
+        released are unaffected; they will be closed when released.
+        """
+        with self._lock:
+            self._max_idle = 0
+        self.clear()
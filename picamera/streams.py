@@ -7,17 +7,110 @@ from __future__ import (
     )
 
 # Make Py2's str equivalent to Py3's
+native_str = str
 str = type('')
 
 
 import io
-from threading import RLock
-from collections import deque
-from operator import attrgetter
+import os
+import sys
+import mmap
+import tempfile
+from array import array
+from threading import RLock, Condition
+try:
+    from time import monotonic
+except ImportError:
+    # Py2.7 doesn't have time.monotonic
+    from time import time as monotonic
+from collections import deque, namedtuple
+from itertools import count
+from concurrent.futures import ThreadPoolExecutor
 from weakref import ref
 
 from picamera.exc import PiCameraValueError
 from picamera.frames import PiVideoFrame, PiVideoFrameType
+from picamera.containers import PiMP4Muxer, _INT64
+
+
+def _write_chunks(output, chunks):
+    # Write *chunks* to *output*, with a vectored write (a single syscall for
+    # many chunks) if *output* has a file descriptor and the platform supports
+    # it, or with one write per chunk otherwise
+    try:
+        fd = output.fileno()
+    except (AttributeError, IOError, OSError):
+        fd = None
+    if fd is None or not hasattr(os, 'writev'):
+        for buf in chunks:
+            output.write(buf)
+        return
+    try:
+        iov_max = os.sysconf('SC_IOV_MAX')
+    except (AttributeError, ValueError, OSError):
+        iov_max = 1024
+    output.flush()
+    views = [memoryview(buf) for buf in chunks if len(buf)]
+    i = 0
+    while i < len(views):
+        written = os.writev(fd, views[i:i + iov_max])
+        # Skip past whatever was written; the final view may have been
+        # written partially
+        while written and i < len(views):
+            if written >= len(views[i]):
+                written -= len(views[i])
+                i += 1
+            else:
+                views[i] = views[i][written:]
+                written = 0
+
+
+def _frame_data(chunks, frames):
+    # Yield each of *frames* with its data, taken in turn from *chunks* which
+    # must begin with the first frame. Data is sliced from the chunks where
+    # possible, and only copied if a frame spans several chunks
+    chunks = iter(chunks)
+    view = memoryview(b'')
+    for frame in frames:
+        size = frame.frame_size
+        parts = []
+        while size:
+            if not len(view):
+                if parts:
+                    # The chunk may not remain valid once the next is fetched
+                    parts = [b''.join(parts)]
+                view = memoryview(next(chunks))
+            part = view[:size]
+            parts.append(part)
+            view = view[len(part):]
+            size -= len(part)
+        yield frame, parts[0] if len(parts) == 1 else b''.join(parts)
+
+
+def _ring_store(ring, offset, view):
+    # Copy *view* into the *ring* memoryview starting at the absolute
+    # *offset*, wrapping around the end of the ring if necessary. The caller
+    # guarantees that len(view) <= len(ring)
+    size = len(ring)
+    start = offset % size
+    head = min(len(view), size - start)
+    ring[start:start + head] = view[:head]
+    if head < len(view):
+        ring[:len(view) - head] = view[head:]
+
+
+def _ring_views(ring, start, end):
+    # Return a list of (at most two) memoryviews covering the absolute offsets
+    # from *start* to *end* within the *ring* memoryview
+    if end <= start:
+        return []
+    size = len(ring)
+    first = start % size
+    last = first + (end - start)
+    if last <= size:
+        return [ring[first:last]]
+    else:
+        return [ring[first:], ring[:last - size]]
 
 
 class BufferIO(io.IOBase):
@@ -84,8 +177,17 @@ class BufferIO(io.IOBase):
         """
 
         """
-        with self.lock:
-            return self._buf.tobytes()
+        self._check_open()
+        return self._buf.tobytes()
+
+    def getbuffer(self):
+        """
+        Return a list containing a single :class:`memoryview` of the entire
+        underlying buffer, for symmetry with :meth:`CircularIO.getbuffer`.
+        No data is copied.
+        """
+        self._check_open()
+        return [self._buf[:]]
 
     def tell(self):
         """
@@ -132,8 +234,26 @@ class BufferIO(io.IOBase):
             return 0
         else:
             b[:result] = self._buf[self._pos:self._pos + result]
+            self._pos += result
             return result
 
+    def read_views(self, n=-1):
+        """
+        As :meth:`read`, but returns a list of :class:`memoryview` objects
+        referencing the underlying buffer instead of copying into a new bytes
+        string. For a :class:`BufferIO` the list will contain at most one
+        view.
+        """
+        self._check_open()
+        if n < 0:
+            n = self._size - self._pos
+        n = max(0, min(n, self._size - self._pos))
+        if n == 0:
+            return []
+        result = self._buf[self._pos:self._pos + n]
+        self._pos += n
+        return [result]
+
     def readall(self):
         """
 
@@ -165,18 +285,37 @@ class BufferIO(io.IOBase):
 
 class CircularIO(io.IOBase):
     """
-
+    A thread-safe stream which uses a ring buffer for storage.
+
+    By default the stream stores its content as a :class:`~collections.deque`
+    of chunks, one per :meth:`write`. If *ring* is ``True``, a single
+    ``bytearray`` of *size* bytes is preallocated instead and content wraps
+    around within it; writes become one or two slice assignments and seeking
+    is constant time, at the cost of evicting individual bytes rather than
+    whole chunks once the stream is full.
     """
-    def __init__(self, size):
+    def __init__(self, size, ring=False):
         if size < 1:
             raise ValueError('size must be a positive integer')
         self._lock = RLock()
+        self._written = Condition(self._lock)
         self._data = deque()
         self._size = size
         self._length = 0
         self._pos = 0
         self._pos_index = 0
         self._pos_offset = 0
+        # Number of bytes evicted from the start of the stream since it was
+        # created; adding this to a position gives an absolute offset which
+        # remains valid across evictions
+        self._offset = 0
+        # Exports in progress (in ring mode); content they have yet to read
+        # is copied to them before it is overwritten or discarded
+        self._exports = set()
+        if ring:
+            self._ring = self._create_ring(size)
+        else:
+            self._ring = None
 
     def _check_open(self):
         if self.closed:
@@ -196,6 +335,14 @@ class CircularIO(io.IOBase):
         """
         return self._size
 
+    @property
+    def ring(self):
+        """
+        Returns ``True`` if the stream is backed by a preallocated ring buffer
+        rather than a deque of chunks.
+        """
+        return self._ring is not None
+
     def readable(self):
         """
         Returns ``True``, indicating that the stream supports :meth:`read`.
@@ -223,10 +370,29 @@ class CircularIO(io.IOBase):
         Return ``bytes`` containing the entire contents of the buffer.
         """
         with self.lock:
+            if self._ring is not None:
+                return b''.join(
+                    self._views(self._offset, self._offset + self._length))
             return b''.join(self._data)
 
+    def _create_ring(self, size):
+        return memoryview(bytearray(size))
+
+    def _store(self, offset, view):
+        # Copy *view* into the ring buffer starting at the absolute *offset*.
+        # This is called before the stream's offset and length are updated
+        # to account for the write
+        _ring_store(self._ring, offset, view)
+
+    def _views(self, start, end):
+        # Return a list of memoryviews covering the absolute offsets from
+        # *start* to *end*
+        return _ring_views(self._ring, start, end)
+
     def _set_pos(self, value):
         self._pos = value
+        if self._ring is not None:
+            return
         self._pos_index = -1
         self._pos_offset = chunk_pos = 0
         for self._pos_index, chunk in enumerate(self._data):
@@ -274,16 +440,73 @@ class CircularIO(io.IOBase):
             with self.lock:
                 if self._pos >= self._length:
                     return b''
-                from_index, from_offset = self._pos_index, self._pos_offset
+                n = min(n, self._length - self._pos)
+                start = self._offset + self._pos
+                result = b''.join(self._segments(start, start + n))
                 self._set_pos(self._pos + n)
-                result = self._data[from_index][from_offset:from_offset + n]
-                # Bah ... can't slice a deque
-                for i in range(from_index + 1, self._pos_index):
-                    result += self._data[i]
-                if from_index < self._pos_index < len(self._data):
-                    result += self._data[self._pos_index][:self._pos_offset]
                 return result
 
+    def readinto(self, b):
+        """
+        Read bytes into the pre-allocated, writable bytes-like object *b*
+        and return the number of bytes read.
+        """
+        self._check_open()
+        b = memoryview(b)
+        if b.ndim > 1 or b.format != 'B':
+            b = b.cast('B')
+        with self.lock:
+            result = 0
+            for view in self.read_views(len(b)):
+                b[result:result + len(view)] = view
+                result += len(view)
+            return result
+
+    def read_views(self, n=-1):
+        """
+        As :meth:`read`, but returns a list of :class:`memoryview` objects
+        referencing the stream's storage instead of copying into a new bytes
+        string. The list can be passed directly to functions like
+        :func:`os.writev` or :meth:`socket.socket.sendmsg`.
+
+        In ring mode the list contains at most two views. In deque mode it
+        contains one view per chunk in the requested range.
+
+        .. warning::
+
+            In ring mode the views reference the ring buffer itself and will
+            be overwritten by subsequent writes; hold :attr:`lock` for as long
+            as the views are in use. In deque mode the views reference
+            immutable chunks and remain valid indefinitely.
+        """
+        self._check_open()
+        with self.lock:
+            if n < 0:
+                n = self._length - self._pos
+            n = max(0, min(n, self._length - self._pos))
+            if n == 0:
+                return []
+            start = self._offset + self._pos
+            result = [
+                memoryview(segment)
+                for segment in self._segments(start, start + n)
+                ]
+            self._set_pos(self._pos + n)
+            return result
+
+    def getbuffer(self):
+        """
+        Return a list of :class:`memoryview` objects covering the entire
+        content of the stream, without copying it. The same caveats apply as
+        for :meth:`read_views`.
+        """
+        self._check_open()
+        with self.lock:
+            return [
+                memoryview(segment) for segment in
+                self._segments(self._offset, self._offset + self._length)
+                ]
+
     def readall(self):
         """
 
@@ -296,8 +519,16 @@ class CircularIO(io.IOBase):
         """
         self._check_open()
         with self.lock:
-            if self._pos == self._length:
+            if self._pos >= self._length or n == 0:
                 return b''
+            if self._ring is not None:
+                if n == -1:
+                    n = self._length - self._pos
+                start = self._offset + self._pos
+                view = self._views(start, start + min(
+                    n, self._length - self._pos))[0]
+                self._pos += len(view)
+                return view.tobytes()
             chunk = self._data[self._pos_index]
             if n == -1:
                 n = len(chunk) - self._pos_offset
@@ -325,6 +556,17 @@ class CircularIO(io.IOBase):
                 fill = b'\x00' * (size - self._length)
                 self._set_pos(self._length)
                 self.write(fill)
+            elif size < self._length and self._ring is not None:
+                if size:
+                    self._preserve(
+                        self._offset + size, self._offset + self._length)
+                    self._length = size
+                else:
+                    # Discard everything by moving the start of the stream
+                    # past it, so that the content is only overwritten (and
+                    # preserved for exports) as the stream is refilled
+                    self._offset += self._length
+                    self._length = 0
             elif size < self._length:
 
                 save_pos = self._pos
@@ -347,6 +589,8 @@ class CircularIO(io.IOBase):
         stream and return the number of bytes written.
         """
         self._check_open()
+        if self._ring is not None:
+            return self._write_ring(b)
         b = bytes(b)
         with self.lock:
 
@@ -382,14 +626,298 @@ class CircularIO(io.IOBase):
                     self.write(b)
             # If the stream is now beyond the specified size limit, remove
             # whole chunks until the size is within the limit again
-            while self._length > self._size:
+            target = self._eviction_target(
+                max(self._offset, self._offset + self._length - self._size))
+            while self._data and self._offset < target:
                 chunk = self._data.popleft()
                 self._length -= len(chunk)
+                self._offset += len(chunk)
                 self._pos -= len(chunk)
                 self._pos_index -= 1
                 # no need to adjust self._pos_offset
+            self._written.notify_all()
+            return result
+
+    def _write_ring(self, b):
+        view = memoryview(b)
+        if view.ndim > 1 or view.format != 'B':
+            view = view.cast('B')
+        with self.lock:
+            if self._pos > self._length:
+                self.truncate()
+            result = len(view)
+            start = self._offset + self._pos
+            end = start + result
+            # Work out the extent of the stream after the write, and hence
+            # how many bytes must be evicted from the start of the buffer to
+            # keep it within the size limit. Only the portion of *b* which
+            # survives eviction is actually copied into the buffer
+            stream_end = max(self._offset + self._length, end)
+            offset = self._eviction_target(
+                max(self._offset, stream_end - self._size))
+            skip = max(0, offset - start)
+            if self._exports:
+                self._preserve(-1, self._overwritten(stream_end, offset))
+                self._preserve(start, end)
+            self._store(start + skip, view[skip:])
+            self._offset = offset
+            self._length = stream_end - self._offset
+            self._pos = end - self._offset
+            self._written.notify_all()
             return result
 
+    def _preserve(self, start, end):
+        # Called before the content from the absolute offset *start* to *end*
+        # is overwritten or discarded in ring mode, to let exports in
+        # progress copy any of it they have yet to read. Must be called with
+        # the lock held
+        for export in self._exports:
+            export.preserve(start, end)
+
+    def _overwritten(self, stream_end, offset):
+        # Return the absolute offset before which content is overwritten by a
+        # write which extends the stream to *stream_end* and evicts content up
+        # to *offset* (content within the range written is overwritten too)
+        return stream_end - self._size
+
+    def _eviction_target(self, offset):
+        # Given the absolute offset which content must be evicted up to in
+        # order to satisfy the size limit (which is the current offset if
+        # nothing need be evicted), return the absolute offset which content
+        # will actually be evicted up to. Descendents may override this to
+        # evict more than strictly necessary (but never less). This is called
+        # during every write; self._pos >= self._length if that write is
+        # appending to the stream
+        return offset
+
+    def _segments(self, start, end):
+        # Return a list of bytes-like objects covering the absolute offsets
+        # from *start* to *end* (clamped to the content of the stream). Must
+        # be called with the lock held
+        start = max(start, self._offset)
+        end = min(end, self._offset + self._length)
+        if end <= start:
+            return []
+        if self._ring is not None:
+            return self._views(start, end)
+        # Readers are usually near the end of the stream so walk backward
+        # from there to find the chunk containing start
+        segments = []
+        pos = self._offset + self._length
+        for chunk in reversed(self._data):
+            pos -= len(chunk)
+            if pos < end:
+                segments.append(chunk)
+            if pos <= start:
+                break
+        segments.reverse()
+        if pos < start:
+            segments[0] = memoryview(segments[0])[start - pos:]
+        trim = sum(len(segment) for segment in segments) - (end - start)
+        if trim:
+            segments[-1] = memoryview(segments[-1])[:len(segments[-1]) - trim]
+        return segments
+
+    def cursor(self, position=None):
+        """
+        Return a new :class:`CircularIOCursor` for reading from the stream
+        independently of its own position.
+
+        The cursor starts at the specified *position* within the stream, or
+        at the end of the stream if *position* is ``None`` (the default), in
+        which case it will only return content written after its creation.
+        """
+        with self.lock:
+            if position is None:
+                position = self._length
+            return CircularIOCursor(self, self._offset + position)
+
+    def close(self):
+        """
+        Extended to wake any cursors blocked waiting for content.
+        """
+        with self.lock:
+            super(CircularIO, self).close()
+            self._written.notify_all()
+
+
+class CircularIOCursor(object):
+    """
+    An independent reader for a :class:`CircularIO` stream, as returned by
+    :meth:`CircularIO.cursor`.
+
+    Each cursor has its own position, so several consumers can read the same
+    stream at their own pace without interfering with each other, or with the
+    stream's own :meth:`~CircularIO.seek` and :meth:`~CircularIO.read`. If
+    content is evicted from the stream before a cursor has read it, the cursor
+    skips forward to the oldest content still available and the number of
+    bytes skipped is added to :attr:`lost`.
+
+    The :meth:`read` and :meth:`read1` methods accept a *timeout* and will
+    block until content is available, the timeout expires, or the stream is
+    closed.
+    """
+    __slots__ = ('_stream', '_offset', '_lost')
+
+    def __init__(self, stream, offset):
+        self._stream = stream
+        self._offset = offset
+        self._lost = 0
+
+    @property
+    def stream(self):
+        """
+        The :class:`CircularIO` the cursor reads from.
+        """
+        return self._stream
+
+    @property
+    def lost(self):
+        """
+        The total number of bytes evicted from the stream before the cursor
+        could read them.
+        """
+        return self._lost
+
+    @property
+    def available(self):
+        """
+        The number of bytes which can currently be read without blocking.
+        """
+        stream = self._stream
+        with stream.lock:
+            return max(0,
+                stream._offset + stream._length - max(self._offset, stream._offset))
+
+    def tell(self):
+        """
+        Return the cursor's position within the stream. This will be negative
+        if content the cursor has not yet read has been evicted.
+        """
+        with self._stream.lock:
+            return self._offset - self._stream._offset
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        """
+        Change the cursor's position, as for :meth:`CircularIO.seek`.
+        """
+        stream = self._stream
+        with stream.lock:
+            if whence == io.SEEK_CUR:
+                offset = self._offset - stream._offset + offset
+            elif whence == io.SEEK_END:
+                offset = stream._length + offset
+            if offset < 0:
+                raise ValueError(
+                    'New position is before the start of the stream')
+            self._offset = stream._offset + offset
+            return offset
+
+    def _wait(self, timeout):
+        # Wait for content beyond the cursor's position and return the
+        # absolute offset of the end of the stream. Must be called with the
+        # lock held
+        stream = self._stream
+        if timeout is None or timeout > 0:
+            end = None if timeout is None else monotonic() + timeout
+            while not stream.closed and (
+                    stream._offset + stream._length <= self._offset):
+                if end is None:
+                    stream._written.wait()
+                else:
+                    remaining = end - monotonic()
+                    if remaining <= 0:
+                        break
+                    stream._written.wait(remaining)
+        if stream._offset > self._offset:
+            self._lost += stream._offset - self._offset
+            self._offset = stream._offset
+        return stream._offset + stream._length
+
+    def read(self, n=-1, timeout=None):
+        """
+        Read up to *n* bytes (or everything available if *n* is -1) from the
+        cursor's position and advance it accordingly.
+
+        If nothing is available, block for up to *timeout* seconds (or
+        indefinitely if *timeout* is ``None``) until content is written to the
+        stream. Returns an empty bytes string if the timeout expires or the
+        stream is closed.
+        """
+        with self._stream.lock:
+            end = self._wait(timeout)
+            if n >= 0:
+                end = min(end, self._offset + n)
+            segments = self._stream._segments(self._offset, end)
+            self._offset += sum(len(segment) for segment in segments)
+            # Segments may be views of a ring buffer so they must be copied
+            # before the lock is released
+            return b''.join(segments)
+
+    def read1(self, n=-1, timeout=None):
+        """
+        As :meth:`read`, but returns content from at most one chunk of the
+        stream's underlying storage, avoiding any copying or concatenation
+        where possible.
+        """
+        with self._stream.lock:
+            end = self._wait(timeout)
+            if n >= 0:
+                end = min(end, self._offset + n)
+            segments = self._stream._segments(self._offset, end)[:1]
+            if not segments:
+                return b''
+            self._offset += len(segments[0])
+            return bytes(segments[0])
+
+
+class _RingExport(object):
+    # Iterates over the content of a ring-mode stream from the absolute offset
+    # *start* to *end*, in pieces of at most PIECE_SIZE bytes, each of which
+    # is copied out of the ring with the lock held. The stream never waits
+    # for the export: content it has yet to read is copied into the export
+    # by preserve() before the stream overwrites or discards it. Must be
+    # constructed with the stream's lock held, and closed when finished with
+    PIECE_SIZE = 1048576
+
+    def __init__(self, stream, start, end):
+        self._stream = stream
+        self._pos = start
+        self._end = end
+        self._saved = deque()
+        stream._exports.add(self)
+
+    def preserve(self, start, end):
+        # Copy the unread content up to *end* if any of it lies within
+        # *start* to *end*. Must be called with the stream's lock held
+        end = min(end, self._end)
+        if start < end and self._pos < end:
+            self._saved.append(
+                b''.join(self._stream._views(self._pos, end)))
+            self._pos = end
+
+    def __iter__(self):
+        stream = self._stream
+        try:
+            while True:
+                with stream.lock:
+                    if self._saved:
+                        piece = self._saved.popleft()
+                    elif self._pos < self._end:
+                        end = min(self._end, self._pos + self.PIECE_SIZE)
+                        piece = b''.join(stream._views(self._pos, end))
+                        self._pos = end
+                    else:
+                        break
+                yield piece
+        finally:
+            self.close()
+
+    def close(self):
+        with self._stream.lock:
+            self._stream._exports.discard(self)
+            self._saved.clear()
+
 
 class PiCameraDequeHack(deque):
     def __init__(self, stream):
@@ -397,36 +925,258 @@ class PiCameraDequeHack(deque):
         self.stream = ref(stream)  # avoid a circular ref
 
     def append(self, item):
-        # Include the frame's metadata.
-        frame = self.stream()._get_frame()
-        return super(PiCameraDequeHack, self).append((item, frame))
+        # Record the frame's meta-data in the stream's index. The stream's
+        # length hasn't been updated to include item yet, hence the addition
+        # below
+        stream = self.stream()
+        frame = stream._get_frame()
+        if frame:
+            stream._index.append(
+                stream._offset + stream._length + len(item), frame)
+        return super(PiCameraDequeHack, self).append(item)
+
+
+class _RingArray(object):
+    # A typed array used as a ring buffer with a logical index running from
+    # 0 (the oldest element) to len-1 (the newest). Storage is allocated up
+    # front and only grows (by doubling) if the capacity is exceeded
+    __slots__ = ('_array', '_head', '_len')
+
+    def __init__(self, typecode, capacity):
+        self._array = array(typecode, [0]) * capacity
+        self._head = 0
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self._len
+        # int() as the array may hold doubles (see _INT64)
+        return int(self._array[(self._head + i) % len(self._array)])
+
+    def append(self, value):
+        if self._len == len(self._array):
+            # Linearize the content and double the capacity
+            a, h = self._array, self._head
+            self._array = a[h:] + a[:h] + array(a.typecode, [0]) * len(a)
+            self._head = 0
+        self._array[(self._head + self._len) % len(self._array)] = value
+        self._len += 1
+
+    def discard_left(self, count):
+        self._head = (self._head + count) % len(self._array)
+        self._len -= count
+
+    def discard_right(self, count):
+        self._len -= count
+
+    def bisect_left(self, value, lo=0):
+        hi = self._len
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self[mid] < value:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def bisect_right(self, value, lo=0):
+        hi = self._len
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if value < self[mid]:
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
 
-    def pop(self):
-        return super(PiCameraDequeHack, self).pop()[0]
 
-    def popleft(self):
-        return super(PiCameraDequeHack, self).popleft()[0]
+class PiCameraFrameIndex(object):
+    """
+    A compact index of the frames recorded in a :class:`PiCameraCircularIO`.
+
+    Frame meta-data is held as a structure of arrays: one preallocated typed
+    array per field, used as a ring buffer with room for *capacity* frames
+    (grown by doubling should that ever prove insufficient). Rows are
+    appended as frames are written and discarded as the stream evicts data,
+    without allocating any per-frame objects; :class:`~picamera.PiVideoFrame`
+    tuples are only constructed when a caller asks for them.
+
+    Rows are identified by a sequence number which increases monotonically
+    over the life of the stream. Because offsets, timestamps, and frame
+    indexes never decrease, searches are binary rather than walking every
+    frame in the stream.
+    """
+    def __init__(self, capacity=1024):
+        self._first = 0  # sequence number of the first live row
+        self._ends = _RingArray(_INT64, capacity)
+        self._sizes = _RingArray(_INT64, capacity)
+        self._timestamps = _RingArray(_INT64, capacity)
+        self._indexes = _RingArray(_INT64, capacity)
+        self._types = _RingArray(native_str('b'), capacity)
+        # Sequence numbers of rows with each frame type, for locating the
+        # first frame of a particular type (e.g. SPS headers)
+        self._by_type = {}
+        self._capacity = capacity
+
+    def __len__(self):
+        return len(self._ends)
 
-    def __getitem__(self, index):
-        return super(PiCameraDequeHack, self).__getitem__(index)[0]
+    @property
+    def first(self):
+        """
+        The sequence number of the oldest row in the index.
+        """
+        return self._first
 
-    def __setitem__(self, index, value):
-        frame = super(PiCameraDequeHack, self).__getitem__(index)[1]
-        return super(PiCameraDequeHack, self).__setitem__(index, (value, frame))
+    @property
+    def last(self):
+        """
+        The sequence number one beyond the newest row in the index.
+        """
+        return self._first + len(self._ends)
 
-    def __iter__(self):
-        for item, frame in self.iter_both(False):
-            yield item
+    def _columns(self):
+        return (
+            self._ends, self._sizes, self._timestamps, self._indexes,
+            self._types)
 
-    def __reversed__(self):
-        for item, frame in self.iter_both(True):
-            yield item
+    def append(self, end, frame):
+        """
+        Add a row for *frame*, which ends at the absolute offset *end*.
+        *frame* may be a :class:`~picamera.PiVideoFrame` or any sequence with
+        the same fields in the same order.
+        """
+        index, frame_type, frame_size, _, _, timestamp, _ = frame
+        if frame_type is None:
+            frame_type = -1
+        try:
+            seqs = self._by_type[frame_type]
+        except KeyError:
+            seqs = self._by_type[frame_type] = _RingArray(
+                _INT64, self._capacity)
+        seqs.append(self.last)
+        self._ends.append(end)
+        self._sizes.append(frame_size)
+        self._timestamps.append(timestamp)
+        self._indexes.append(index)
+        self._types.append(frame_type)
+
+    def evict(self, offset):
+        """
+        Remove rows for frames which start before the absolute *offset*.
+        """
+        count = 0
+        while count < len(self._ends) and (
+                self._ends[count] - self._sizes[count] < offset):
+            count += 1
+        if count:
+            self._first += count
+            for column in self._columns():
+                column.discard_left(count)
+            for seqs in self._by_type.values():
+                seqs.discard_left(seqs.bisect_left(self._first))
+
+    def truncate(self, end):
+        """
+        Remove rows for frames which end beyond the absolute offset *end*.
+        """
+        count = 0
+        while count < len(self._ends) and self._ends[-1 - count] > end:
+            count += 1
+        if count:
+            for column in self._columns():
+                column.discard_right(count)
+            for seqs in self._by_type.values():
+                seqs.discard_right(len(seqs) - seqs.bisect_left(self.last))
+
+    def frame(self, seq, offset):
+        """
+        Return a :class:`~picamera.PiVideoFrame` for the row with sequence
+        number *seq*, with positions relative to the absolute *offset*.
+        """
+        i = seq - self._first
+        pos = self._ends[i] - offset
+        return PiVideoFrame(
+            index=self._indexes[i],
+            frame_type=None if self._types[i] == -1 else self._types[i],
+            frame_size=self._sizes[i],
+            video_size=pos,
+            split_size=pos,
+            timestamp=self._timestamps[i],
+            complete=True,
+            )
+
+    def find_time(self, timestamp):
+        """
+        Return the absolute offset of the start of the first frame with a
+        timestamp at or after *timestamp*, or ``None`` if there is no such
+        frame.
+        """
+        i = self._timestamps.bisect_left(timestamp)
+        if i < len(self._ends):
+            return self._ends[i] - self._sizes[i]
+        return None
 
-    def iter_both(self, reverse):
-        if reverse:
-            return super(PiCameraDequeHack, self).__reversed__()
-        else:
-            return super(PiCameraDequeHack, self).__iter__()
+    @property
+    def timestamp(self):
+        """
+        The timestamp of the newest row in the index, or ``None`` if the index
+        is empty.
+        """
+        if self:
+            return self._timestamps[-1]
+        return None
+
+    def find_start(self, offset, frame_type):
+        """
+        Return the absolute offset of the start of the first frame with the
+        specified *frame_type* which starts at or after the absolute
+        *offset*, or ``None`` if there is no such frame.
+        """
+        seq = self._first + self._ends.bisect_right(offset)
+        while True:
+            seq = self.find_first(seq, frame_type)
+            if seq is None:
+                return None
+            i = seq - self._first
+            start = self._ends[i] - self._sizes[i]
+            if start >= offset:
+                return start
+            seq += 1
+
+    def find_first(self, seq, frame_type):
+        """
+        Return the sequence number of the first row at or after *seq* with the
+        specified *frame_type* (any type if *frame_type* is ``None``), or
+        ``None`` if no such row exists.
+        """
+        if frame_type is None:
+            return seq if seq < self.last else None
+        try:
+            seqs = self._by_type[frame_type]
+        except KeyError:
+            return None
+        i = seqs.bisect_left(seq)
+        if i < len(seqs):
+            return seqs[i]
+        return None
+
+    def find_span(self, field, criteria):
+        """
+        Return the sequence number of the newest row for which the newest
+        row's *field* exceeds it by at least *criteria*, or the oldest row if
+        none does. The index must not be empty.
+        """
+        column = {
+            'video_size': self._ends,
+            'timestamp': self._timestamps,
+            'index': self._indexes,
+            }[field]
+        target = column[-1] - criteria
+        return self._first + max(0, column.bisect_right(target) - 1)
 
 
 class PiCameraDequeFrames(object):
@@ -434,74 +1184,180 @@ class PiCameraDequeFrames(object):
         super(PiCameraDequeFrames, self).__init__()
         self.stream = ref(stream)  # avoid a circular ref
 
+    def _iter_frames(self, reverse):
+        stream = self.stream()
+        with stream.lock:
+            index = stream._index
+            seqs = range(index.first, index.last)
+            for seq in (reversed(seqs) if reverse else seqs):
+                frame = index.frame(seq, stream._offset)
+                # Only yield the frame meta-data if the start of the frame
+                # still exists in the stream
+                if frame.position >= 0:
+                    yield frame
+
     def __iter__(self):
-        with self.stream().lock:
-            pos = 0
-            for item, frame in self.stream()._data.iter_both(False):
-                pos += len(item)
-                if frame:
-                    # Rewrite the video_size and split_size attributes
-                    # according to the current position of the chunk
-                    frame = PiVideoFrame(
-                        index=frame.index,
-                        frame_type=frame.frame_type,
-                        frame_size=frame.frame_size,
-                        video_size=pos,
-                        split_size=pos,
-                        timestamp=frame.timestamp,
-                        complete=frame.complete,
-                    )
-                    # Only yield the frame meta-data if the start of the frame
-                    # still exists in the stream
-                    if pos - frame.frame_size >= 0:
-                        yield frame
+        return self._iter_frames(False)
 
     def __reversed__(self):
-        with self.stream().lock:
-            pos = self.stream()._length
-            for item, frame in self.stream()._data.iter_both(True):
-                if frame:
-                    frame = PiVideoFrame(
-                        index=frame.index,
-                        frame_type=frame.frame_type,
-                        frame_size=frame.frame_size,
-                        video_size=pos,
-                        split_size=pos,
-                        timestamp=frame.timestamp,
-                        complete=frame.complete,
-                        )
-                    if pos - frame.frame_size >= 0:
-                        yield frame
-                pos -= len(item)
+        return self._iter_frames(True)
+
+
+class PiCameraFramesUpdate(namedtuple('PiCameraFramesUpdate', (
+    'frames',
+    'start',
+    'end',
+    'token',
+    'lost',
+    ))):
+    """
+    The result of :meth:`PiCameraCircularIO.frames_since`.
+
+    .. attribute:: frames
+
+        A list of the :class:`~picamera.PiVideoFrame` meta-data of frames
+        written since the token passed in, oldest first.
+
+    .. attribute:: start
+
+        The position within the stream of the start of the first frame in
+        :attr:`frames`, or of the end of the stream if :attr:`frames` is
+        empty.
+
+    .. attribute:: end
+
+        The position within the stream of the end of the last frame in
+        :attr:`frames`, or of the end of the stream if :attr:`frames` is
+        empty.
+
+    .. attribute:: token
+
+        The token to pass to the next call of
+        :meth:`~PiCameraCircularIO.frames_since`.
+
+    .. attribute:: lost
+
+        The number of frames which were evicted from the stream before they
+        could be returned, because the token passed in had fallen behind.
+    """
+
+    __slots__ = () # workaround python issue #24931
 
 
 class PiCameraCircularIO(CircularIO):
     """
+    A derivative of :class:`CircularIO` which tracks camera frames.
+
+    If *ring* is ``True`` the stream is backed by a single preallocated ring
+    buffer (see :class:`CircularIO`). In either mode, the meta-data of
+    complete frames is recorded in a :class:`PiCameraFrameIndex` which is
+    used to locate frames for :attr:`frames` and :meth:`copy_to`.
+
+    The *evict* parameter controls what is discarded when the stream exceeds
+    its size. The default, ``'size'``, discards just enough of the oldest
+    content (whole chunks in deque mode, bytes in ring mode) to satisfy the
+    limit. With ``'gop'`` the stream instead discards whole groups of
+    pictures, evicting up to the next SPS header (or key frame, if the stream
+    has no inline headers) so that the retained content always begins at a
+    decodable point.
+
+    If *duration* is specified the stream additionally discards frames whose
+    timestamps are more than *duration* seconds older than the newest frame,
+    so that it retains the last *duration* seconds of video however the
+    bitrate varies. In this case *size* (or *seconds*) is optional and acts as
+    a hard limit on memory use; it is required when *ring* is ``True``. When
+    combined with ``evict='gop'``, time-based eviction also cuts at the start
+    of a GOP.
+
+    The *index_capacity* parameter sets the number of frames the index of
+    frame meta-data can hold before it must grow; the default suits 30
+    seconds of video at 30fps.
     """
     def __init__(
             self, camera, size=None, seconds=None, bitrate=17000000,
-            splitter_port=1):
+            splitter_port=1, ring=False, export_threads=2, evict='size',
+            duration=None, index_capacity=1024):
+        if evict not in ('size', 'gop'):
+            raise PiCameraValueError('Invalid eviction mode %s' % evict)
+        if duration is not None and duration <= 0:
+            raise PiCameraValueError('duration must be a positive number')
         if size is None and seconds is None:
-            raise PiCameraValueError('You must specify either size, or seconds')
+            if duration is None:
+                raise PiCameraValueError('You must specify either size, or seconds')
+            if ring:
+                raise PiCameraValueError(
+                    'You must specify either size, or seconds with ring')
+            # Without a hard limit, eviction is purely time-based
+            size = sys.maxsize
         if size is not None and seconds is not None:
             raise PiCameraValueError('You cannot specify both size and seconds')
         if seconds is not None:
             size = bitrate * seconds // 8
-        super(PiCameraCircularIO, self).__init__(size)
+        super(PiCameraCircularIO, self).__init__(size, ring)
         try:
             camera._encoders
         except AttributeError:
             raise PiCameraValueError('camera must be a valid PiCamera object')
         self.camera = camera
         self.splitter_port = splitter_port
-        self._data = PiCameraDequeHack(self)
+        if not ring:
+            self._data = PiCameraDequeHack(self)
+        self._index = PiCameraFrameIndex(index_capacity)
         self._frames = PiCameraDequeFrames(self)
+        self._export_threads = export_threads
+        self._executor = None
+        self._evict = evict
+        self._duration = duration
+
+    def _eviction_target(self, offset):
+        if self._duration is not None and self._pos >= self._length:
+            # The frame being written may not have been indexed yet
+            frame = self._get_frame()
+            timestamp = frame[5] if frame else self._index.timestamp
+            if timestamp is not None:
+                start = self._index.find_time(
+                    timestamp - int(self._duration * 1000000))
+                if start is not None:
+                    offset = max(offset, start)
+        if self._evict == 'gop' and offset > self._offset:
+            # Evict up to the start of the first complete GOP that satisfies
+            # the size limit; failing that (e.g. a single GOP larger than the
+            # buffer) fall back to evicting just enough to satisfy the limit
+            for frame_type in (
+                    PiVideoFrameType.sps_header, PiVideoFrameType.key_frame):
+                target = self._index.find_start(offset, frame_type)
+                if target is not None:
+                    return target
+        return offset
+
+    @property
+    def duration(self):
+        """
+        The number of seconds of video retained by time-based eviction, or
+        ``None`` if the stream is limited by size alone.
+        """
+        return self._duration
+
+    @property
+    def evict(self):
+        """
+        The eviction mode of the stream, as specified at construction.
+        """
+        return self._evict
 
     def _get_frame(self):
         """
+        Return the meta-data of the encoder's current frame if it is complete,
+        or ``None`` otherwise. The result is a sequence with the same fields
+        as :class:`~picamera.PiVideoFrame` but, where the encoder supports it,
+        is its raw frame state rather than a tuple constructed for the call.
         """
         encoder = self.camera._encoders[self.splitter_port]
-        return encoder.frame if encoder.frame.complete else None
+        try:
+            frame = encoder._frame_state
+        except AttributeError:
+            frame = encoder.frame
+        return frame if frame[6] else None
 
     @property
     def frames(self):
@@ -509,6 +1365,42 @@ class PiCameraCircularIO(CircularIO):
         """
         return self._frames
 
+    def write(self, b):
+        """
+        Extended to maintain the frame index.
+        """
+        with self.lock:
+            end = self._offset + self._length
+            result = super(PiCameraCircularIO, self).write(b)
+            if self._ring is not None and self._offset + self._length > end:
+                # In deque mode, PiCameraDequeHack takes care of this
+                frame = self._get_frame()
+                if frame:
+                    self._index.append(self._offset + self._length, frame)
+            self._index.evict(self._offset)
+            return result
+
+    def truncate(self, size=None):
+        """
+        Extended to maintain the frame index.
+        """
+        with self.lock:
+            result = super(PiCameraCircularIO, self).truncate(size)
+            self._index.truncate(self._offset + self._length)
+            self._index.evict(self._offset)
+            return result
+
+    def close(self):
+        """
+        Extended to wait for any outstanding exports started by
+        :meth:`copy_to_async` to complete.
+        """
+        with self.lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+        super(PiCameraCircularIO, self).close()
+
     def clear(self):
         """
 
@@ -517,70 +1409,610 @@ class PiCameraCircularIO(CircularIO):
             self.seek(0)
             self.truncate()
 
+    def frames_since(self, token=None):
+        """
+        Return the frames written to the stream since *token*.
+
+        Returns a :class:`PiCameraFramesUpdate` containing the meta-data of
+        frames written since the call which returned *token* (or all frames
+        currently in the stream if *token* is ``None``), the range of stream
+        positions those frames occupy, the token to pass to the next call, and
+        the number of frames which were evicted before they could be returned.
+        Only the new frames are visited, so polling with this method is much
+        cheaper than iterating over :attr:`frames`.
+
+        Tokens are opaque; the only valid values are ``None`` and those
+        returned by this method. Truncating the stream (for instance with
+        :meth:`clear`) invalidates all outstanding tokens.
+        """
+        with self.lock:
+            index = self._index
+            lost = 0
+            if token is None:
+                token = index.first
+            elif token < index.first:
+                lost = index.first - token
+                token = index.first
+            frames = [
+                index.frame(seq, self._offset)
+                for seq in range(token, index.last)
+                ]
+            if frames:
+                start = frames[0].position
+                end = frames[-1].position + frames[-1].frame_size
+            else:
+                start = end = self._length
+            return PiCameraFramesUpdate(
+                frames, start, end, max(token, index.last), lost)
+
     def _find(self, field, criteria, first_frame):
-        first = last = None
-        attr = attrgetter(field)
-        for frame in reversed(self._frames):
-            if last is None:
-                last = frame
-            if first_frame in (None, frame.frame_type):
-                first = frame
-            if last is not None and attr(last) - attr(frame) >= criteria:
-                break
-                if last is not None and attr(last) - attr(frame) >= criteria:
-                    break
+        # Return the sequence numbers of the first and last frames to copy
+        if not self._index:
+            return None, None
+        last = self._index.last - 1
+        first = self._index.find_first(
+            self._index.find_span(field, criteria), first_frame)
         return first, last
 
     def _find_all(self, first_frame):
-        chunks = []
-        first = last = None
-        for frame in reversed(self._frames):
-            last = frame
-            break
-        for frame in self._frames:
-            if first_frame in (None, frame.frame_type):
-                first = frame
-                break
+        if not self._index:
+            return None, None
+        last = self._index.last - 1
+        first = self._index.find_first(self._index.first, first_frame)
         return first, last
 
-    def copy_to(
-            self, output, size=None, seconds=None, frames=None,
-            first_frame=PiVideoFrameType.sps_header):
-        """
+    def _get_frames(self, *seqs):
+        return tuple(
+            None if seq is None else self._index.frame(seq, self._offset)
+            for seq in seqs)
+
+    def _get_chunks(self, first, last):
+        # Return the chunks of data covering the frames first to last. Must be
+        # called with the lock held
+        if first is None or last is None:
+            return []
+        start = first.position
+        end = last.position + last.frame_size
+        if self._ring is not None:
+            # The ring buffer will be overwritten once the lock is released;
+            # rather than copying the range out here, register it so that the
+            # writer copies out anything it is about to overwrite before the
+            # export has read it
+            return _RingExport(self, self._offset + start, self._offset + end)
+        # Walk backward from the end of the stream as the requested range
+        # is usually recent; this avoids visiting every chunk in the stream
+        chunks = []
+        pos = self._length
+        for buf in reversed(self._data):
+            pos -= len(buf)
+            if pos < start:
+                break
+            elif pos < end:
+                chunks.append(buf)
+        chunks.reverse()
+        return chunks
 
-        """
+    def _snapshot(self, size, seconds, frames, first_frame, container):
         if (size, seconds, frames).count(None) < 2:
             raise PiCameraValueError(
                 'You can only specify one of size, seconds, or frames')
+        if container not in ('h264', 'mp4'):
+            raise PiCameraValueError('Invalid container %s' % container)
+        with self.lock:
+            if size is not None:
+                first, last = self._find('video_size', size, first_frame)
+            elif seconds is not None:
+                seconds = int(seconds * 1000000)
+                first, last = self._find('timestamp', seconds, first_frame)
+            elif frames is not None:
+                first, last = self._find('index', frames, first_frame)
+            else:
+                first, last = self._find_all(first_frame)
+            if container == 'mp4' and first is not None:
+                # The muxer needs the meta-data of every frame copied
+                meta = [
+                    self._index.frame(seq, self._offset)
+                    for seq in range(first, last + 1)
+                    ]
+            else:
+                meta = None
+            first, last = self._get_frames(first, last)
+            return first, last, self._get_chunks(first, last), meta
+
+    def _export(self, output, first, last, chunks, meta):
+        try:
+            return self._export_chunks(output, first, last, chunks, meta)
+        finally:
+            if isinstance(chunks, _RingExport):
+                chunks.close()
+
+    def _export_chunks(self, output, first, last, chunks, meta):
         if isinstance(output, bytes):
             output = output.decode('utf-8')
         opened = isinstance(output, str)
         if opened:
             output = io.open(output, 'wb')
         try:
-            with self.lock:
-                if size is not None:
-                    first, last = self._find('video_size', size, first_frame)
-                elif seconds is not None:
-                    seconds = int(seconds * 1000000)
-                    first, last = self._find('timestamp', seconds, first_frame)
-                elif frames is not None:
-                    first, last = self._find('index', frames, first_frame)
+            if meta is None:
+                if isinstance(chunks, _RingExport):
+                    # Write each piece before the next is read, so that no
+                    # more than one piece is held at a time
+                    for piece in chunks:
+                        _write_chunks(output, (piece,))
                 else:
-                    first, last = self._find_all(first_frame)
-
-                chunks = []
-                if first is not None and last is not None:
-                    pos = 0
-                    for buf, frame in self._data.iter_both(False):
-                        if pos > last.position + last.frame_size:
-                            break
-                        elif pos >= first.position:
-                            chunks.append(buf)
-                        pos += len(buf)
-            for buf in chunks:
-                output.write(buf)
+                    _write_chunks(output, chunks)
+            else:
+                muxer = PiMP4Muxer(output)
+                for frame, data in _frame_data(chunks, meta):
+                    muxer.write_frame(
+                        data, frame.timestamp or 0,
+                        frame.frame_type == PiVideoFrameType.key_frame)
+                muxer.close()
             return first, last
         finally:
             if opened:
                 output.close()
+
+    def copy_to(
+            self, output, size=None, seconds=None, frames=None,
+            first_frame=PiVideoFrameType.sps_header, container='h264'):
+        """
+        If *container* is ``'mp4'`` the content is written as a fragmented
+        MP4 file (see :class:`~picamera.PiMP4Muxer`) rather than as a raw
+        H.264 stream; this requires the copy to start with an SPS header.
+        """
+        first, last, chunks, meta = self._snapshot(
+            size, seconds, frames, first_frame, container)
+        return self._export(output, first, last, chunks, meta)
+
+    def copy_to_async(
+            self, output, size=None, seconds=None, frames=None,
+            first_frame=PiVideoFrameType.sps_header, container='h264'):
+        """
+        Start copying content from the stream to *output* in the background.
+
+        The parameters are the same as for :meth:`copy_to`, but the frames to
+        copy are resolved and the relevant chunks captured immediately, with
+        the writing performed by a background thread. The stream continues to
+        accept writes (and to evict old data) while the copy proceeds, and
+        several copies may be in progress at once (up to the *export_threads*
+        value given to the constructor run concurrently).
+
+        Returns a :class:`~concurrent.futures.Future` which will hold the
+        ``(first, last)`` frames copied, as returned by :meth:`copy_to`.
+
+        .. note::
+
+            In deque mode the chunks captured are simply references to the
+            (immutable) data in the stream. In ring mode only the range is
+            captured, and it is copied out of the ring in pieces of at most
+            1MB as it is written. Writes never wait for the copy; instead any
+            part of the range not yet copied is copied by a write (or a
+            truncation) before it is overwritten.
+        """
+        first, last, chunks, meta = self._snapshot(
+            size, seconds, frames, first_frame, container)
+        try:
+            with self.lock:
+                self._check_open()
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(self._export_threads)
+                return self._executor.submit(
+                    self._export, output, first, last, chunks, meta)
+        except:
+            if isinstance(chunks, _RingExport):
+                chunks.close()
+            raise
+
+
+class PiCameraTieredCircularIO(PiCameraCircularIO):
+    """
+    A :class:`PiCameraCircularIO` which spills older content to disk.
+
+    The newest *size* bytes (or *seconds* of video at *bitrate*) are held in
+    a ring buffer in memory, as with ``PiCameraCircularIO(..., ring=True)``.
+    As content ages out of memory it is copied to a second ring buffer of
+    *disk_size* bytes, which is a memory-mapped file on disk. The total
+    capacity of the stream is therefore *size* plus *disk_size* bytes, but
+    only *size* bytes of it count against the process's memory.
+
+    If *filename* is ``None`` (the default) an anonymous temporary file is
+    used for the disk tier; otherwise the named file is created (or
+    overwritten) and is left on disk when the stream is closed. In either
+    case the file is allocated once at construction and reused circularly
+    thereafter.
+
+    Positions, :attr:`~PiCameraCircularIO.frames`, and
+    :meth:`~PiCameraCircularIO.copy_to` cover both tiers transparently.
+    """
+    def __init__(
+            self, camera, size=None, seconds=None, bitrate=17000000,
+            splitter_port=1, disk_size=None, filename=None, export_threads=2,
+            evict='size', duration=None):
+        if size is None and seconds is None:
+            raise PiCameraValueError('You must specify either size, or seconds')
+        if size is not None and seconds is not None:
+            raise PiCameraValueError('You cannot specify both size and seconds')
+        if not disk_size or disk_size < 1:
+            raise PiCameraValueError('disk_size must be a positive integer')
+        if seconds is not None:
+            size = bitrate * seconds // 8
+        if filename is None:
+            self._file = tempfile.TemporaryFile()
+        else:
+            self._file = io.open(filename, 'w+b')
+        try:
+            self._file.truncate(disk_size)
+            self._mmap = mmap.mmap(self._file.fileno(), disk_size)
+        except:
+            self._file.close()
+            raise
+        self._disk = memoryview(self._mmap)
+        # Content before this absolute offset lives in the disk tier; content
+        # from it onward lives in the memory tier
+        self._spilled = 0
+        # The memory tier is allocated by _create_ring, which is called by
+        # the super-class' constructor with the total capacity of both tiers;
+        # stash the memory tier's size for it here
+        self._memory_size = size
+        super(PiCameraTieredCircularIO, self).__init__(
+            camera, size=size + disk_size,
+            splitter_port=splitter_port, ring=True,
+            export_threads=export_threads, evict=evict, duration=duration)
+
+    def _create_ring(self, size):
+        return memoryview(bytearray(self._memory_size))
+
+    @property
+    def memory_size(self):
+        """
+        Return the size of the memory tier in bytes.
+        """
+        return len(self._ring)
+
+    @property
+    def disk_size(self):
+        """
+        Return the size of the disk tier in bytes.
+        """
+        return len(self._disk)
+
+    def close(self):
+        """
+        Extended to release the disk tier.
+        """
+        super(PiCameraTieredCircularIO, self).close()
+        if self._mmap is not None:
+            try:
+                self._disk.release()
+            except AttributeError:
+                # Py2.7 doesn't have memoryview.release
+                pass
+            self._mmap.close()
+            self._file.close()
+            self._mmap = None
+
+    def _store(self, offset, view):
+        end = offset + len(view)
+        stream_end = self._offset + self._length
+        spilled = max(self._spilled, end - len(self._ring))
+        if spilled > self._spilled:
+            # Move content about to be overwritten in the memory tier to the
+            # disk tier first, ignoring anything this write will evict
+            pos = max(
+                self._spilled, self._offset,
+                max(stream_end, end) - self._size)
+            for chunk in _ring_views(self._ring, pos, min(spilled, stream_end)):
+                _ring_store(self._disk, pos, chunk)
+                pos += len(chunk)
+            self._spilled = spilled
+        split = min(max(offset, spilled), end)
+        if split > offset:
+            _ring_store(self._disk, offset, view[:split - offset])
+        if end > split:
+            _ring_store(self._ring, split, view[split - offset:])
+
+    def _views(self, start, end):
+        split = min(max(start, self._spilled), end)
+        return (
+            _ring_views(self._disk, start, split) +
+            _ring_views(self._ring, split, end))
+
+    def _overwritten(self, stream_end, offset):
+        # Evicted content is never spilled to the disk tier, so anything
+        # evicted from the memory tier is overwritten when it wraps around
+        return max(
+            stream_end - self._size,
+            min(offset, stream_end - self._memory_size))
+
+    def truncate(self, size=None):
+        """
+        Extended to move the boundary between tiers back if the stream is
+        truncated into the disk tier.
+        """
+        with self.lock:
+            result = super(PiCameraTieredCircularIO, self).truncate(size)
+            self._spilled = min(self._spilled, self._offset + self._length)
+            return result
+
+
+class PiCameraSegment(namedtuple('PiCameraSegment', (
+    'index',
+    'output',
+    'start',
+    'end',
+    'size',
+    ))):
+    """
+    Describes a segment recorded by :class:`PiCameraSegmenter`; instances are
+    passed to its *segment_closed* callback.
+
+    .. attribute:: index
+
+        The number of the segment, counting from 0.
+
+    .. attribute:: output
+
+        The filename or file-like object the segment was written to.
+
+    .. attribute:: start
+
+        The timestamp (in microseconds) of the first frame of the segment,
+        or ``None`` if the segment contains no frames.
+
+    .. attribute:: end
+
+        The timestamp (in microseconds) of the last frame of the segment, or
+        ``None`` if the segment contains no frames.
+
+    .. attribute:: size
+
+        The number of bytes written to the segment.
+    """
+
+    __slots__ = () # workaround python issue #24931
+
+
+class PiCameraSegmenter(object):
+    """
+    An output which divides an H.264 recording into segments of at most
+    *seconds* seconds or *size* bytes.
+
+    *outputs* is an iterable of filenames or file-like objects, one for each
+    segment, or a string which is formatted with the ``index`` of each
+    segment, e.g. ``'clip{index:04d}.h264'``. Pass the instance as the output
+    of :meth:`~picamera.PiCamera.start_recording` (on the same
+    *splitter_port*), and call :meth:`close` after recording has stopped.
+
+    The meta-data of the encoder's frames is used to predict when the current
+    segment will reach its limit; just before it does, a key frame is
+    requested from the encoder and the next segment begins with its SPS
+    header (or with the key frame itself if the recording has no inline
+    headers). Hence segments are cut within a frame of their limit, rather
+    than at the next natural GOP boundary, and no call to
+    :meth:`~picamera.PiCamera.split_recording` is required.
+
+    Each output is opened (if it is a filename) in a background thread
+    before it is needed, and finished segments are closed in the same
+    thread, after which *segment_closed* is called (in that thread) with a
+    :class:`PiCameraSegment` describing the segment. If *outputs* is
+    exhausted, recording continues in the final segment without limit.
+    """
+    def __init__(
+            self, camera, outputs, seconds=None, size=None, splitter_port=1,
+            segment_closed=None):
+        if seconds is None and size is None:
+            raise PiCameraValueError('You must specify either size, or seconds')
+        if seconds is not None and seconds <= 0:
+            raise PiCameraValueError('seconds must be a positive number')
+        if size is not None and size < 1:
+            raise PiCameraValueError('size must be a positive integer')
+        try:
+            camera._encoders
+        except AttributeError:
+            raise PiCameraValueError('camera must be a valid PiCamera object')
+        self.camera = camera
+        self.splitter_port = splitter_port
+        if isinstance(outputs, str):
+            template = outputs
+            outputs = (template.format(index=index) for index in count())
+        self._outputs = iter(outputs)
+        self._seconds = seconds
+        self._size = size
+        self._segment_closed = segment_closed
+        self._lock = RLock()
+        self._closed = False
+        self._current = self._open_next()
+        if self._current is None:
+            raise PiCameraValueError('outputs must not be empty')
+        # The executor opens and closes outputs; key frames are requested
+        # from a separate thread so they aren't delayed by slow I/O
+        self._executor = ThreadPoolExecutor(1)
+        self._control = ThreadPoolExecutor(1)
+        self._next = self._executor.submit(self._open_next)
+        self._closing = None
+        self._exhausted = False
+        self._index = 0
+        self._last = (None, True)
+        self._start_segment()
+
+    def _start_segment(self):
+        self._written = 0
+        self._frames = 0
+        self._start = None
+        self._end = None
+        self._interval = 0
+        self._pending = False
+        self._deferred = False
+
+    def _open_next(self):
+        try:
+            output = next(self._outputs)
+        except StopIteration:
+            return None
+        if isinstance(output, str):
+            return (output, io.open(output, 'wb'), True)
+        return (output, output, False)
+
+    def _close_segment(self, current, segment):
+        output, stream, opened = current
+        if opened:
+            stream.close()
+        else:
+            try:
+                stream.flush()
+            except AttributeError:
+                pass
+        if self._segment_closed:
+            self._segment_closed(segment)
+
+    def _request_key_frame(self):
+        encoder = self.camera._encoders.get(self.splitter_port)
+        if encoder is not None:
+            encoder.request_key_frame()
+
+    @property
+    def closed(self):
+        return self._closed
+
+    @property
+    def index(self):
+        """
+        Returns the number of the segment currently being written.
+        """
+        return self._index
+
+    @property
+    def output(self):
+        """
+        Returns the filename or file-like object of the segment currently
+        being written.
+        """
+        return self._current[0]
+
+    def write(self, b):
+        """
+        Write *b* to the current segment, first starting a new segment if
+        the current one is due to end and *b* starts a GOP.
+        """
+        with self._lock:
+            if self._closed:
+                raise ValueError('I/O operation on closed segmenter')
+            encoder = self.camera._encoders[self.splitter_port]
+            try:
+                frame = encoder._frame_state
+            except AttributeError:
+                frame = encoder.frame
+            if frame:
+                frame_type, complete = frame[1], frame[6]
+            else:
+                frame_type, complete = None, True
+            last_type, last_complete = self._last
+            if self._pending and last_complete and (
+                    frame_type == PiVideoFrameType.sps_header or (
+                        frame_type == PiVideoFrameType.key_frame and
+                        last_type != PiVideoFrameType.sps_header)):
+                self._switch()
+            self._last = (frame_type, complete)
+            result = self._current[1].write(b)
+            self._written += len(b)
+            if complete and frame_type in (
+                    PiVideoFrameType.frame, PiVideoFrameType.key_frame):
+                timestamp = frame[5]
+                if self._start is None:
+                    self._start = timestamp
+                elif timestamp > self._end:
+                    self._interval = timestamp - self._end
+                self._end = timestamp
+                self._frames += 1
+                if not (self._pending or self._exhausted) and self._due():
+                    self._pending = True
+                    self._control.submit(self._request_key_frame)
+            return result
+
+    def _due(self):
+        # Returns True if the segment will reach its limit with the next frame
+        if self._seconds is not None and (
+                self._end - self._start + self._interval >=
+                self._seconds * 1000000):
+            return True
+        if self._size is not None and (
+                self._written + self._written // self._frames >= self._size):
+            return True
+        return False
+
+    def _switch(self):
+        if self._closing is not None and self._closing.done():
+            # Re-raise any error from closing the previous segment
+            self._closing.result()
+        if not self._next.done():
+            # Don't block the encoder's callback waiting for the next output
+            # to open; switch at a later key frame instead, requesting one
+            # when the output is ready
+            if not self._deferred:
+                self._deferred = True
+                self._next.add_done_callback(self._next_ready)
+            return
+        current = self._next.result()
+        if current is None:
+            # Outputs are exhausted; carry on in the current segment, which
+            # is no longer limited
+            self._exhausted = True
+            self._pending = False
+            return
+        self._closing = self._executor.submit(
+            self._close_segment, self._current, PiCameraSegment(
+                self._index, self._current[0], self._start, self._end,
+                self._written))
+        self._current = current
+        self._index += 1
+        self._start_segment()
+        self._next = self._executor.submit(self._open_next)
+
+    def _next_ready(self, future):
+        try:
+            self._control.submit(self._request_key_frame)
+        except RuntimeError:
+            # The segmenter has been closed
+            pass
+
+    def flush(self):
+        """
+        Flush the current segment.
+        """
+        with self._lock:
+            try:
+                self._current[1].flush()
+            except AttributeError:
+                pass
+
+    def close(self):
+        """
+        Close the current segment (calling *segment_closed* for it) and any
+        output which was opened ahead of time but not used; the latter is
+        deleted if it was opened from a filename.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._closing = self._executor.submit(
+                self._close_segment, self._current, PiCameraSegment(
+                    self._index, self._current[0], self._start, self._end,
+                    self._written))
+            unused = self._next
+        try:
+            self._closing.result()
+            unused = unused.result()
+            if unused is not None and unused[2]:
+                unused[1].close()
+                os.unlink(unused[0])
+        finally:
+            self._executor.shutdown(wait=True)
+            self._control.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self.close()
@@ -41,6 +41,7 @@ __keywords__ = [
 ]
 
 __requires__ = [
+    'futures; python_version < "3"',
 ]
 
 __extra_requires__ = {
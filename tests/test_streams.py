@@ -0,0 +1,104 @@
+from __future__ import (
+    unicode_literals,
+    print_function,
+    division,
+    absolute_import,
+    )
+
+import io
+import threading
+
+import pytest
+
+from picamera.frames import PiVideoFrame, PiVideoFrameType
+from picamera.streams import (
+    CircularIO,
+    PiCameraCircularIO,
+    PiCameraTieredCircularIO,
+    )
+
+
+class FakeEncoder(object):
+    frame = None
+
+
+class FakeCamera(object):
+    def __init__(self):
+        self._encoders = {1: FakeEncoder()}
+
+
+class BlockingOutput(io.BytesIO):
+    # An output whose writes wait until released, standing in for a slow
+    # destination
+    def __init__(self):
+        super(BlockingOutput, self).__init__()
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def write(self, b):
+        self.started.set()
+        assert self.release.wait(10)
+        return super(BlockingOutput, self).write(b)
+
+
+def write_frames(stream, data, frame_size=10):
+    encoder = stream.camera._encoders[1]
+    for i in range(0, len(data), frame_size):
+        frame_type = (
+            PiVideoFrameType.sps_header if i == 0 else
+            PiVideoFrameType.frame)
+        encoder.frame = PiVideoFrame(
+            i // frame_size, frame_type, frame_size, i + frame_size, 0,
+            i * 1000, True)
+        stream.write(data[i:i + frame_size])
+
+
+def ring_stream(tiered):
+    if tiered:
+        return PiCameraTieredCircularIO(FakeCamera(), size=40, disk_size=60)
+    return PiCameraCircularIO(FakeCamera(), size=100, ring=True)
+
+
+@pytest.mark.parametrize('tiered', [False, True])
+def test_ring_export_does_not_block_writer(tiered):
+    stream = ring_stream(tiered)
+    data = b''.join(bytes(bytearray([65 + i] * 10)) for i in range(10))
+    write_frames(stream, data)
+    output = BlockingOutput()
+    future = stream.copy_to_async(output)
+    assert output.started.wait(10)
+    # Overwrite the whole ring several times while the export is stalled
+    write_frames(stream, b'z' * 300)
+    output.release.set()
+    future.result(10)
+    assert output.getvalue() == data
+    stream.close()
+
+
+@pytest.mark.parametrize('tiered', [False, True])
+def test_ring_clear_during_export(tiered):
+    stream = ring_stream(tiered)
+    data = b''.join(bytes(bytearray([65 + i] * 10)) for i in range(10))
+    write_frames(stream, data)
+    output = BlockingOutput()
+    future = stream.copy_to_async(output)
+    assert output.started.wait(10)
+    stream.clear()
+    assert stream.getvalue() == b''
+    assert list(stream.frames) == []
+    write_frames(stream, b'z' * 150)
+    output.release.set()
+    future.result(10)
+    assert output.getvalue() == data
+    assert stream.getvalue() == b'z' * 100
+    stream.close()
+
+
+@pytest.mark.parametrize('ring', [False, True])
+def test_read1_zero(ring):
+    stream = CircularIO(10, ring=ring)
+    stream.write(b'abcdef')
+    stream.seek(2)
+    assert stream.read1(0) == b''
+    assert stream.tell() == 2
+    assert stream.read1(2) == b'cd'